@@ -24,6 +24,7 @@ class AirGapVisualization {
         this._orientation = 0
         this._vesselHeight = null
 
+        this.clearance = null
         this.depths = []
         this.geoJSON = null
         this.heights = []
@@ -85,9 +86,14 @@ class AirGapVisualization {
         this.elements.clearHeight.type = "button"
         this.elements.clearHeight.value = "Clear"
 
+        this.elements.opening = document.createElement("span")
+        this.elements.opening.style.marginLeft = "10px"
+        this.elements.controls.append(this.elements.opening)
+
         this.elements.clearHeight.addEventListener("click", (e) => {
             this.elements.vesselHeight.input.value = ""
             this.vesselHeight = null
+            this.elements.opening.textContent = ""
 
             var element = this.elements.impassable
             element.getContext("2d").clearRect(0,0,element.width,element.height)
@@ -314,6 +320,12 @@ class AirGapVisualization {
     }
 
     _groupHeights() {
+        if (this.geoJSON.features[0].properties.steps) {
+            //simplified contours are already expanded to one height per column by _loadHeights
+            this.groupedHeights = this.heights.map((height) => [height])
+            return
+        }
+
         var coordinates = this.coordinates
 
         var startPoint = coordinates[0]
@@ -434,12 +446,35 @@ class AirGapVisualization {
 
         this.geoJSON = await response.json()
 
-        if ((initial == "up" && upstream == "east_west") || (initial == "down" && upstream == "west_east")) {
-            this.coordinates.reverse()
+        //simplified contours do not have a clearance index, so they do not show the opening widths
+        this.clearance = this.geoJSON.features[0].properties.clearance || null
+
+        var steps = this.geoJSON.features[0].properties.steps
+
+        if (steps) {
+            //simplified contours only keep some of the columns, the rest are on the straight lines
+            //between them
+            var coordinates = this.coordinates
+
+            for (var i = 0; i < steps.length - 1; ++i) {
+                var start = coordinates[i][2]
+                var end = coordinates[i+1][2]
+
+                for (var step = steps[i]; step < steps[i+1]; ++step) {
+                    this.heights.push(start + (end - start)*(step - steps[i])/(steps[i+1] - steps[i]))
+                }
+            }
+            this.heights.push(coordinates.last[2])
+        }
+        else {
+            for (var c of this.coordinates) {
+                this.heights.push(c[2])
+            }
         }
 
-        for (var c of this.coordinates) {
-            this.heights.push(c[2])
+        if ((initial == "up" && upstream == "east_west") || (initial == "down" && upstream == "west_east")) {
+            this.coordinates.reverse()
+            this.heights.reverse()
         }
     }
 
@@ -495,6 +530,54 @@ class AirGapVisualization {
         }
     }
 
+    _showOpening() {
+        if (!this.clearance) {
+            return
+        }
+
+        //the index holds the heights above the contour's datum, so the vessel is moved by the
+        //change in air gap. Blocked columns are 0 and stay blocked when the water is low.
+        var height = Math.max(this.vesselHeight + this.gapChange, 0)
+        var clearance = this.clearance
+
+        //the widest opening of the highest threshold at or below the height, as searchsorted
+        //does in ClearanceIndex.level
+        var low = 0
+        var high = clearance.thresholds.length
+
+        while (low < high) {
+            var middle = (low + high) >> 1
+
+            if (clearance.thresholds[middle] === null || clearance.thresholds[middle] <= height) {
+                low = middle + 1
+            }
+            else {
+                high = middle
+            }
+        }
+
+        var widest = clearance.widest_widths[Math.max(low - 1, 0)]
+
+        //the columns higher than the height are the ones after it in the sorted heights
+        low = 0
+        high = clearance.sorted_heights.length
+
+        while (low < high) {
+            var middle = (low + high) >> 1
+
+            if (clearance.sorted_heights[middle] <= height) {
+                low = middle + 1
+            }
+            else {
+                high = middle
+            }
+        }
+
+        var passable = clearance.sorted_heights.length - low
+
+        this.elements.opening.textContent = `Widest Opening: ${(widest * this.metersPerPixel.x).toFixed(1)}m Passable Width: ${(passable * this.metersPerPixel.x).toFixed(1)}m`
+    }
+
     _valueForPosition(position) {
         position = Math.min(position, this.groupedHeights.length-1)
 
@@ -536,6 +619,9 @@ class AirGapVisualization {
     }
 
     get airGapURL() {
+        if (this.options.proxy) {
+            return `${this.options.proxy}/station/${this.options.stationID}`
+        }
         return `https://api.tidesandcurrents.noaa.gov/api/prod/datagetter?date=latest&station=${this.options.stationID}&product=air_gap&time_zone=gmt&units=metric&format=json`
     }
 
@@ -614,6 +700,7 @@ class AirGapVisualization {
 
         if (isNaN(this._vesselHeight)) {
             this.elements.vesselHeight.input.style.backgroundColor = "rgb(255, 127, 127)"
+            this.elements.opening.textContent = ""
             var element = this.elements.impassable
             element.getContext("2d").clearRect(0,0,element.width,element.height)
         }
@@ -623,6 +710,7 @@ class AirGapVisualization {
         else {
             this.elements.vesselHeight.input.style.backgroundColor = "white"
             this._showImpassable()
+            this._showOpening()
         }
     }
 
@@ -700,6 +788,9 @@ class WaterGageVisualization extends AirGapVisualization {
     }
     
     urlForGage(gage) {
+        if (this.options.proxy) {
+            return `${this.options.proxy}/gage/${gage}`
+        }
         return `https://water.weather.gov/ahps2/hydrograph_to_xml.php?gage=${gage}&output=xml`
     }
 }
@@ -1,22 +1,107 @@
-from enum import Enum
-from PIL import Image, ImageEnhance
-from pyproj import Transformer
-from scipy.spatial.transform import Rotation
-
 from qgis.core import *
 from qgis.PyQt.QtCore import QCoreApplication
 
 import json
 import math
 import numpy
+import os
 import sys
 
+#laspy, PIL, pyproj, scipy, the kernels, the process pool and the scheduler are imported where they
+#are used, so that each run only pays for the parts its settings use
+
+from .clearance import ClearanceIndex, simplify_heights
+from .options import ContourStatistic, Direction, Engine
+
 def lm(message):
     QgsMessageLog.logMessage(str(message))
 
-class Direction(Enum):
-    EAST_TO_WEST = "east_west"
-    WEST_TO_EAST = "west_east"
+def read_points(point_cloud_path):
+    import laspy
+
+    if point_cloud_path.endswith(".laz"):
+        l = laspy.open(point_cloud_path, laz_backend=laspy.LazBackend.Laszip)
+    else:
+        l = laspy.open(point_cloud_path)
+
+    points = l.read()
+    l.close()
+
+    return points
+
+def cached_read_points(point_cloud_path, cache):
+    #AirGapPoints never modifies the points it is given, so cached points can be reused as is
+    points = cache.get(point_cloud_path)
+
+    if points is None:
+        points = read_points(point_cloud_path)
+        cache.put(point_cloud_path, points, len(points) * points.header.point_format.size)
+        lm(f"Point cloud cache miss for {point_cloud_path}: {cache.statistics()}")
+    else:
+        lm(f"Point cloud cache hit for {point_cloud_path}: {cache.statistics()}")
+
+    return points
+
+#ASPRS classes that are never part of a bridge: low vegetation, medium vegetation, high vegetation,
+#low noise, water and high noise. Unclassified points are kept, so unclassified clouds are unchanged.
+DEFAULT_POINT_FILTER = {
+    "include_classifications": [],
+    "exclude_classifications": [3, 4, 5, 7, 9, 18],
+    "include_returns": [],
+    "exclude_returns": [],
+    "minimum_intensity": 0,
+    "maximum_intensity": 65535
+}
+
+def filter_points(points, point_filter=None):
+    #an empty include list keeps every value. Runs before the points are rotated or indexed, so
+    #dropped points cost nothing in the later stages.
+    if not point_filter:
+        return points
+
+    keep = numpy.ones(len(points), dtype=bool)
+
+    for field, include, exclude in [
+        ("classification", "include_classifications", "exclude_classifications"),
+        ("return_number", "include_returns", "exclude_returns")
+    ]:
+        if point_filter.get(include) or point_filter.get(exclude):
+            values = numpy.asarray(getattr(points, field))
+
+            if point_filter.get(include):
+                keep &= numpy.isin(values, point_filter[include])
+            if point_filter.get(exclude):
+                keep &= ~numpy.isin(values, point_filter[exclude])
+
+    minimum_intensity = point_filter.get("minimum_intensity", 0)
+    maximum_intensity = point_filter.get("maximum_intensity", 65535)
+
+    if minimum_intensity > 0 or maximum_intensity < 65535:
+        intensity = numpy.asarray(points.intensity)
+        keep &= (intensity >= minimum_intensity) & (intensity <= maximum_intensity)
+
+    if keep.all():
+        return points
+
+    lm(f"Point filter kept {numpy.count_nonzero(keep)} of {len(points)} points")
+
+    return points[keep]
+
+def bridge_path(path, bridge):
+    root, extension = os.path.splitext(path)
+    return f"{root}_{bridge}{extension}"
+
+def variant_path(path, width):
+    root, extension = os.path.splitext(path)
+    return f"{root}_{width}{extension}"
+
+def lanes_path(path):
+    root, extension = os.path.splitext(path)
+    return f"{root}_lanes{extension}"
+
+def level_of_detail_path(path, level):
+    root, extension = os.path.splitext(path)
+    return f"{root}_lod{level}{extension}"
 
 def find_color(color_grid, closest_y, xyz, r, g, b, black_and_white=False, direction = Direction.WEST_TO_EAST, progress_bar = None, bar_steps = 50):
     length = len(xyz)
@@ -58,9 +143,436 @@ def find_color(color_grid, closest_y, xyz, r, g, b, black_and_white=False, direc
                     ]
     return color_grid
 
+def decimate_points(xyz, x_width, direction=Direction.WEST_TO_EAST):
+    #xyz must already be in pixel coordinates. Only the points nearest the viewer in each pixel,
+    #at float32 precision, can win the depth test in find_color, so everything behind them is dropped
+    cells = xyz[:,2].astype(numpy.int64) * x_width + xyz[:,0].astype(numpy.int64)
+
+    if direction == Direction.WEST_TO_EAST:
+        depth = xyz[:,1]
+    else:
+        depth = -xyz[:,1]
+
+    from .parallel import nearest_points
+
+    #the points are kept in file order, so find_color picks the same winner among them
+    return nearest_points(cells, depth)
+
+def bin_statistics(bins, heights, steps, percentile=1, kth_lowest=3):
+    bins = bins.astype(numpy.int64)
+    in_range = (bins >= 0) & (bins < steps)
+    bins = bins[in_range]
+
+    #one sort groups the points by bin with each bin's heights in ascending order, so every
+    #statistic below is a lookup at an offset from the start of its bin
+    order = numpy.lexsort((heights[in_range], bins))
+    heights = heights[in_range][order]
+
+    counts = numpy.bincount(bins, minlength=steps)
+    starts = numpy.cumsum(counts) - counts
+    occupied = counts > 0
+    last = numpy.maximum(counts - 1, 0)
+
+    def at(offsets):
+        values = numpy.full(steps, numpy.nan)
+        values[occupied] = heights[(starts + offsets)[occupied]]
+        return values
+
+    #linear interpolation between the closest ranks, same as numpy.percentile
+    position = last * percentile / 100
+    lower = numpy.floor(position).astype(numpy.int64)
+    upper = numpy.ceil(position).astype(numpy.int64)
+    lower_values = at(lower)
+
+    return {
+        "count": counts,
+        "minimum": at(0),
+        "percentile": lower_values + (at(upper) - lower_values) * (position - lower),
+        "kth_lowest": at(numpy.minimum(kth_lowest - 1, last))
+    }
+
+def reduce_minima(minima, steps):
+    #each bin takes the minimum of every finer bin it overlaps, so the clearance is never raised
+    fine_steps = len(minima)
+
+    if steps == fine_steps:
+        return minima
+
+    bins = numpy.arange(steps)
+    starts = bins * fine_steps // steps
+    ends = -(-(bins + 1) * fine_steps // steps)
+
+    #reduceat covers the bins up to the next start, the last bin it misses is the one straddling the edge
+    return numpy.minimum(numpy.minimum.reduceat(minima, starts), minima[ends - 1])
+
+def nearest_samples(depths, width, padding_left, sample_width, sample_padding_left, sample_padding_right):
+    #the finer sample nearest each coarser sample position along the line between the ends
+    positions = (numpy.arange(sample_width + sample_padding_left + sample_padding_right) - sample_padding_left) / sample_width
+    indices = numpy.clip(numpy.rint(positions * width + padding_left).astype(int), 0, len(depths) - 1)
+
+    return [depths[i] for i in indices]
+
+def subsample_points(points, maximum_points):
+    if len(points) <= maximum_points:
+        return points
+
+    indices = numpy.arange(0, len(points), math.ceil(len(points) / maximum_points))
+
+    return points[indices]
+
+DEFAULT_ADJUSTMENTS = {
+    "brightness": 1,
+    "contrast": 1,
+    "saturation": 1,
+    "sharpness": 0
+}
+
+def apply_adjustments(image, adjustments=DEFAULT_ADJUSTMENTS):
+    from PIL import ImageEnhance
+
+    image = ImageEnhance.Brightness(image).enhance(adjustments["brightness"])
+    image = ImageEnhance.Contrast(image).enhance(adjustments["contrast"])
+    image = ImageEnhance.Color(image).enhance(adjustments["saturation"])
+    image = ImageEnhance.Sharpness(image).enhance(adjustments["sharpness"])
+
+    return image
+
+def scheduler_progress(progress_bar):
+    if not progress_bar:
+        return None, None
+
+    progress_bar.setFormat("Generating: %p%")
+
+    return lambda fraction: progress_bar.setValue(int(fraction * 100)), QCoreApplication.processEvents
+
+def generate_visualization(points, end_points, contour_path, depth_path=None, bathymetry_layer=None, threads=1, progress_bar=None,
+        point_filter=None, **settings):
+    points = filter_points(points, point_filter)
+
+    job = VisualizationJob(AirGapPoints(points, *end_points), contour_path, depth_path=depth_path, bathymetry_layer=bathymetry_layer, **settings)
+
+    if threads > 1:
+        from .scheduler import StageScheduler
+
+        scheduler = StageScheduler(threads)
+        job.add_stages(scheduler)
+
+        progress, poll = scheduler_progress(progress_bar)
+        scheduler.run(progress=progress, poll=poll)
+    else:
+        job.run(progress_bar)
+
+    return job.result()
+
+def generate_bridges(points, bridges, bathymetry_layer=None, corridor_width=100, cell_size=50, threads=1, progress_bar=None,
+        point_filter=None, **settings):
+    #bridges is a dictionary of bridge ID to a dictionary with end_points, contour, depth and
+    #images paths. The point cloud is indexed once and each bridge only processes its corridor.
+    points = filter_points(points, point_filter)
+
+    grid = PointGrid(points.xyz, cell_size=cell_size)
+
+    jobs = {}
+
+    for bridge, paths in bridges.items():
+        jobs[bridge] = bridge_job(points, grid, paths["end_points"], paths["contour"], depth_path=paths.get("depth"),
+            bathymetry_layer=bathymetry_layer, corridor_width=corridor_width, **settings)
+
+    def save(bridge, direction):
+        jobs[bridge].save_images(bridges[bridge]["images"], directions=[direction])
+
+    if threads > 1:
+        from .scheduler import StageScheduler
+
+        scheduler = StageScheduler(threads)
+
+        for bridge, job in jobs.items():
+            for direction, stage in zip(job.directions, job.add_stages(scheduler, f"{bridge} ")):
+                scheduler.add(f"{bridge} save {direction.value}", lambda bridge=bridge, direction=direction: save(bridge, direction), [stage])
+
+        progress, poll = scheduler_progress(progress_bar)
+        scheduler.run(progress=progress, poll=poll)
+    else:
+        for bridge, job in jobs.items():
+            if progress_bar:
+                progress_bar.setValue(0)
+
+            job.run(progress_bar)
+
+            for direction in job.directions:
+                save(bridge, direction)
+
+    return {bridge: job.result() for bridge, job in jobs.items()}
+
+def corridor_margin(end_points, settings):
+    #the images extend past the end points by the side padding
+    length = math.dist(end_points[0], end_points[1])
+
+    return max(settings.get("padding_left", 0), settings.get("padding_right", 0)) * length / settings.get("width", 1000)
+
+def within_corridor(xy, ends, width, margin=0):
+    #whether each point is within width of the line between the ends and no more than margin past
+    #either end
+    start = numpy.asarray(ends[0], dtype=float)
+    end = numpy.asarray(ends[1], dtype=float)
+    length = numpy.linalg.norm(end - start)
+    along = (end - start) / length
+    across = numpy.array([-along[1], along[0]])
+
+    offsets = xy - start
+    distance_along = offsets @ along
+    distance_across = offsets @ across
+
+    return (distance_along >= -margin) & (distance_along <= length + margin) & (numpy.abs(distance_across) <= width)
+
+def bridge_job(points, grid, end_points, contour_path, depth_path=None, bathymetry_layer=None, corridor_width=100, **settings):
+    corridor = grid.corridor(end_points, corridor_width, corridor_margin(end_points, settings) + grid.cell_size)
+
+    return VisualizationJob(AirGapPoints(points[corridor], *end_points), contour_path, depth_path=depth_path,
+        bathymetry_layer=bathymetry_layer, **settings)
+
+class PointGrid():
+    def __init__(self, xyz, cell_size=50):
+        #buckets the point indices by x/y grid cell with one sort, so any rectangle of cells can be
+        #read back as contiguous ranges of the sorted indices
+        self.xyz = xyz
+        self.cell_size = cell_size
+        self.origin = xyz[:,:2].min(axis=0)
+
+        cells = numpy.floor((xyz[:,:2] - self.origin) / cell_size).astype(numpy.int64)
+        self.shape = cells.max(axis=0) + 1
+
+        cell_ids = cells[:,0] * self.shape[1] + cells[:,1]
+        self.order = numpy.argsort(cell_ids, kind="stable")
+
+        counts = numpy.bincount(cell_ids, minlength=self.shape[0] * self.shape[1])
+        self.starts = numpy.cumsum(counts) - counts
+        self.ends = self.starts + counts
+
+    def rectangle(self, minimum, maximum):
+        low = numpy.clip(numpy.floor((numpy.asarray(minimum) - self.origin) / self.cell_size).astype(numpy.int64), 0, self.shape - 1)
+        high = numpy.clip(numpy.floor((numpy.asarray(maximum) - self.origin) / self.cell_size).astype(numpy.int64), 0, self.shape - 1)
+
+        ranges = []
+
+        #cells in the same x column are adjacent in the sorted order, so each column is one range
+        for x in range(low[0], high[0] + 1):
+            start = self.starts[x * self.shape[1] + low[1]]
+            end = self.ends[x * self.shape[1] + high[1]]
+
+            if end > start:
+                ranges.append(self.order[start:end])
+
+        if not ranges:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        return numpy.concatenate(ranges)
+
+    def corridor(self, ends, width, margin=0):
+        #indices, in file order, of the points within width of the line between the ends and
+        #no more than margin past either end
+        reach = width + margin
+        candidates = self.rectangle(numpy.minimum(ends[0], ends[1]) - reach, numpy.maximum(ends[0], ends[1]) + reach)
+
+        return numpy.sort(candidates[within_corridor(self.xyz[candidates,:2], ends, width, margin)])
+
+class VisualizationJob():
+    directions = [Direction.EAST_TO_WEST, Direction.WEST_TO_EAST]
+
+    def __init__(self, point_cloud, contour_path, depth_path=None, bathymetry_layer=None, band=1, width=1000, minimum_height=20,
+            padding_left=0, padding_right=0, padding_bottom=0, refine_ends=True, decimate=False, processes=1,
+            statistic=ContourStatistic.MINIMUM, percentile=1, kth_lowest=3, flag_tolerance=0.5, maximum_height=None, levels_of_detail=(), widths=(), lane_offsets=(),
+            lane_width=10, engine=Engine.REFERENCE, direction=Direction.WEST_TO_EAST):
+        self.point_cloud = point_cloud
+        self.point_cloud.engine = engine
+        self.contour_path = contour_path
+        self.depth_path = depth_path
+        self.bathymetry_layer = bathymetry_layer
+        self.band = band
+        self.width = width
+        self.minimum_height = minimum_height
+        self.padding_left = padding_left
+        self.padding_right = padding_right
+        self.padding_bottom = padding_bottom
+        self.refine_ends = refine_ends
+        self.decimate = decimate
+        self.processes = processes
+        self.statistic = statistic
+        self.percentile = percentile
+        self.kth_lowest = kth_lowest
+        self.flag_tolerance = flag_tolerance
+        self.maximum_height = maximum_height
+        self.levels_of_detail = levels_of_detail
+        self.lane_offsets = lane_offsets
+        self.lane_width = lane_width
+        self.direction = direction
+
+        #widths are extra outputs made from the same pass, written next to the main files with the
+        #width added to their names
+        self.widths = sorted(set(widths) - {width}, reverse=True)
+        self.variants = {width: {"scale": None, "adjusted_padding_bottom": None, "maximum_depth": None, "images": {}} for width in self.widths}
+
+        self.scale = None
+        self.adjusted_padding_bottom = None
+        self.images = {}
+
+    def paddings(self, width):
+        #paddings are in pixels at the main width, so they are scaled the same way as the preview
+        if width == self.width:
+            return self.padding_left, self.padding_right, self.padding_bottom
+
+        ratio = width / self.width
+
+        return int(self.padding_left * ratio), int(self.padding_right * ratio), int(self.padding_bottom * ratio)
+
+    def contour(self, progress_bar=None):
+        if not self.widths:
+            self.point_cloud.create_contour(self.contour_path, minimum_height=self.minimum_height, steps=self.width, refine_ends=self.refine_ends,
+                direction=self.direction, processes=self.processes, statistic=self.statistic, percentile=self.percentile,
+                kth_lowest=self.kth_lowest, flag_tolerance=self.flag_tolerance, levels_of_detail=self.levels_of_detail, lane_offsets=self.lane_offsets, lane_width=self.lane_width,
+                progress_bar=progress_bar, bar_steps=33)
+            return
+
+        #the other widths are binned once at the finest width and each of their bins is the minimum
+        #of the finer bins it covers. The main width is always binned on its own, with its flagged
+        #bins, so adding a width never changes the main contour. The other statistics do not
+        #combine that way, so they bin at each width.
+        fine_width = max(self.widths[0], self.width)
+
+        fine_minima = None
+        if self.statistic == ContourStatistic.MINIMUM:
+            fine_minima = self.point_cloud.bin_minima(fine_width, self.minimum_height, self.refine_ends, self.processes)
+
+        #the main contour is written last so it is the one left on the point cloud
+        for width in self.widths + [self.width]:
+            main = width == self.width
+
+            minima = None
+            if fine_minima is not None and not main:
+                minima = reduce_minima(fine_minima, width)
+
+            self.point_cloud.create_contour(self.contour_path if main else variant_path(self.contour_path, width), minimum_height=self.minimum_height,
+                steps=width, refine_ends=self.refine_ends, direction=self.direction, processes=self.processes, statistic=self.statistic,
+                percentile=self.percentile, kth_lowest=self.kth_lowest, flag_tolerance=self.flag_tolerance, levels_of_detail=self.levels_of_detail,
+                minima=minima, lane_offsets=self.lane_offsets, lane_width=self.lane_width, progress_bar=progress_bar if main else None, bar_steps=33)
+
+    def depth(self):
+        if not self.widths:
+            self.point_cloud.create_depth(self.depth_path, self.bathymetry_layer, steps=self.width, padding_left=self.padding_left,
+                padding_right=self.padding_right, direction=self.direction, band=self.band)
+            return
+
+        #the raster is sampled once at the finest width and the other widths take the nearest sample.
+        #The main width is always sampled on its own, and last so its depths are left on the point cloud.
+        fine_width = max(self.widths[0], self.width)
+        fine_padding_left, fine_padding_right, _ = self.paddings(fine_width)
+
+        if fine_width != self.width:
+            self.point_cloud.create_depth(None, self.bathymetry_layer, steps=fine_width, padding_left=fine_padding_left,
+                padding_right=fine_padding_right, direction=self.direction, band=self.band)
+            fine_depths = self.point_cloud.depths
+
+        self.point_cloud.create_depth(self.depth_path, self.bathymetry_layer, steps=self.width, padding_left=self.padding_left,
+            padding_right=self.padding_right, direction=self.direction, band=self.band)
+
+        if fine_width == self.width:
+            fine_depths = self.point_cloud.depths
+
+        for width in self.widths:
+            padding_left, padding_right, _ = self.paddings(width)
+            depths = nearest_samples(fine_depths, fine_width, fine_padding_left, width, padding_left, padding_right)
+
+            self.variants[width]["maximum_depth"] = min(depths)
+
+            if self.depth_path:
+                with open(variant_path(self.depth_path, width), "w") as f:
+                    json.dump(depths, f)
+
+    def image(self, image_direction, progress_bar=None, bar_steps=50):
+        if not self.widths:
+            self.scale, self.adjusted_padding_bottom, self.images[image_direction.value] = self.point_cloud.create_image(None, width=self.width,
+                padding_left=self.padding_left, padding_right=self.padding_right, padding_bottom=self.padding_bottom,
+                minimum_height=self.minimum_height, direction=image_direction, refine_ends=self.refine_ends, decimate=self.decimate,
+                processes=self.processes, maximum_height=self.maximum_height, progress_bar=progress_bar, bar_steps=bar_steps)
+            return
+
+        #the points hidden behind others at every width are dropped once, then each width only
+        #draws what is left
+        widths = self.widths + [self.width]
+        candidates = self.point_cloud.visible_points([(width, *self.paddings(width)[:2]) for width in widths], direction=image_direction,
+            minimum_height=self.minimum_height, refine_ends=self.refine_ends)
+
+        for width in widths:
+            main = width == self.width
+            padding_left, padding_right, padding_bottom = self.paddings(width)
+
+            result = self.point_cloud.create_image(None, width=width, padding_left=padding_left, padding_right=padding_right,
+                padding_bottom=padding_bottom, minimum_height=self.minimum_height, maximum_depth=None if main else self.variants[width]["maximum_depth"],
+                direction=image_direction, refine_ends=self.refine_ends, decimate=self.decimate, processes=self.processes,
+                maximum_height=self.maximum_height, candidates=candidates, progress_bar=progress_bar if main else None, bar_steps=bar_steps)
+
+            if main:
+                self.scale, self.adjusted_padding_bottom, self.images[image_direction.value] = result
+            else:
+                variant = self.variants[width]
+                variant["scale"], variant["adjusted_padding_bottom"], variant["images"][image_direction.value] = result
+
+    def save_images(self, paths, adjustments=None, directions=None):
+        #paths are the main image for each direction, the other widths are saved next to it
+        for image_direction in self.directions if directions == None else directions:
+            image_adjustments = (adjustments or {}).get(image_direction.value, DEFAULT_ADJUSTMENTS)
+
+            apply_adjustments(self.images[image_direction.value], image_adjustments).save(paths[image_direction.value])
+
+            for width, variant in self.variants.items():
+                apply_adjustments(variant["images"][image_direction.value], image_adjustments).save(variant_path(paths[image_direction.value], width))
+
+    def run(self, progress_bar=None, stages=None):
+        #stages limits the run to some of contour, depth and the image directions. The ends are
+        #refined up front in that case so the files match the ones from a full run, and with extra
+        #widths so the cloud is only rotated once.
+        if stages != None or self.widths:
+            self.point_cloud.prepare_frame(self.minimum_height, self.refine_ends)
+
+        if stages == None or "contour" in stages:
+            self.contour(progress_bar)
+
+        if self.bathymetry_layer and (stages == None or "depth" in stages):
+            self.depth()
+
+        for image_direction, bar_steps in zip(self.directions, [34, 33]):
+            if stages == None or image_direction.value in stages:
+                self.image(image_direction, progress_bar, bar_steps)
+
+    def add_stages(self, scheduler, prefix=""):
+        #the contour, depth and the two images only depend on the rotated frame, apart from the
+        #images needing the maximum depth for their bottom padding. Returns the image stage names.
+        frame = prefix + "frame"
+        scheduler.add(frame, lambda: self.point_cloud.prepare_frame(self.minimum_height, self.refine_ends))
+        scheduler.add(prefix + "contour", self.contour, [frame], weight=33)
+
+        image_dependencies = [frame]
+
+        #QGIS layers belong to the thread that created them, so depth sampling stays on that thread
+        if self.bathymetry_layer:
+            scheduler.add(prefix + "depth", self.depth, [frame], main_thread=True)
+            image_dependencies.append(prefix + "depth")
+
+        stages = []
+
+        for image_direction in self.directions:
+            stages.append(prefix + image_direction.value)
+            scheduler.add(stages[-1], lambda image_direction=image_direction: self.image(image_direction), image_dependencies, weight=33)
+
+        return stages
+
+    def result(self):
+        return self.point_cloud, self.scale, self.adjusted_padding_bottom, self.images, self.variants
+
 class AirGapPoints():
-    def __init__(self, points, western_end, eastern_end):
+    def __init__(self, points, western_end, eastern_end, engine=Engine.REFERENCE):
         self.points = points
+        self.engine = engine
         self.xyz = self.points.xyz
         self.mins = points.header.mins
         self.ends = [western_end, eastern_end]
@@ -69,35 +581,41 @@ class AirGapPoints():
 
         self.contour = []
         self.depths = []
+        self.flagged_bins = []
+        self.clearance = None
+        self.lanes = None
+        self.envelope = None
+        self.frame = None
 
-    def create_contour(self, contour_file, minimum_height=20, steps=1000, refine_ends=True, direction=Direction.WEST_TO_EAST, progress_bar = None, bar_steps=50):
-        dx = self.ends[1][0] - self.ends[0][0]
-        dy = self.ends[1][1] - self.ends[0][1]
-        angle = math.atan(dy/dx)
-
-        self.rotate_points(angle, clockwise=True)
-
-        r_ends = self.rotate_ends(angle, self.ends, clockwise=True)
-
-        if refine_ends:
-            refinement_condition = lambda x: x >= minimum_height
-            r_ends = self.refine_ends(r_ends, angle, refinement_condition)
+    def create_contour(self, contour_file, minimum_height=20, steps=1000, refine_ends=True, direction=Direction.WEST_TO_EAST, processes=1,
+            statistic=ContourStatistic.MINIMUM, percentile=1, kth_lowest=3, flag_tolerance=0.5, levels_of_detail=(), minima=None,
+            lane_offsets=(), lane_width=10, progress_bar = None, bar_steps=50):
+        angle, r_ends, xyz, rotated = self.enter_frame(minimum_height, refine_ends)
 
         dx = self.ends[1][0] - self.ends[0][0]
         dy = self.ends[1][1] - self.ends[0][1]
 
-        r_step = (r_ends[1][0] - r_ends[0][0])/steps
         contour_x_step = dx/steps
         contour_y_step = dy/steps
 
-        r_contour_points = self.xyz[numpy.logical_and(
-            self.xyz[:,0] >= r_ends[0][0],
-            self.xyz[:,0] <= r_ends[1][0]
-        )]
+        #minima are given when they were already reduced from a finer contour
+        if minima is not None:
+            statistics = {"minimum": minima}
+        else:
+            r_contour_points = self.contour_points(xyz, r_ends, steps)
 
-        r_contour_points -= [r_ends[0][0], 0, 0]
-        r_contour_points /= [r_step, 1, 1]
-        r_contour_points[:,0] = numpy.floor(r_contour_points[:,0])
+            #the minimum and kth lowest can be merged from partial results, with the counts that
+            #flagging needs, the percentile needs the single process grouped pass
+            if processes > 1 and statistic != ContourStatistic.PERCENTILE:
+                from .parallel import parallel_lowest
+
+                statistics = parallel_lowest(r_contour_points, steps, kth_lowest=kth_lowest, processes=processes)
+            else:
+                statistics = bin_statistics(r_contour_points[:,0], r_contour_points[:,2], steps, percentile=percentile, kth_lowest=kth_lowest)
+
+        bin_heights = statistics[statistic.value]
+
+        from pyproj import Transformer
 
         utm_to_wgs = Transformer.from_crs("EPSG:32615", "EPSG:4326", always_xy=True)
         coordinates = []
@@ -107,37 +625,82 @@ class AirGapPoints():
         if progress_bar:
             progress_bar.setFormat("Creating Contour: %p%")
 
-        for i in range(steps):
-            if i != 0 and progress_bar and i % update_interval == 0:
-                progress_bar.setValue(progress_bar.value() + 1)
-                QCoreApplication.processEvents()
-
-            pixel_group = r_contour_points[r_contour_points[:,0] == i]
-
-            #there should always be a pixel group in a full point cloud, but highly thinned ones
-            #might be missing points in a group
-            if len(pixel_group) > 0:
-                height = numpy.min(pixel_group[:,2])
+        if self.engine == Engine.NUMPY:
+            from . import kernels
 
-            if height < minimum_height:
-                height = 0
+            longitude, latitude, heights = utm_to_wgs.transform(
+                self.ends[0][0] + numpy.arange(steps)*contour_x_step,
+                self.ends[0][1] + numpy.arange(steps)*contour_y_step,
+                kernels.contour_heights(bin_heights, minimum_height)
+            )
+            coordinates = list(zip(longitude.tolist(), latitude.tolist(), heights.tolist()))
 
-            coordinates.append(utm_to_wgs.transform(
-                self.ends[0][0] + i*contour_x_step,
-                self.ends[0][1] + i*contour_y_step,
-                height
-            ))
+            if progress_bar:
+                progress_bar.setValue(progress_bar.value() + bar_steps)
+        else:
+            for i in range(steps):
+                if i != 0 and progress_bar and i % update_interval == 0:
+                    progress_bar.setValue(progress_bar.value() + 1)
+                    QCoreApplication.processEvents()
+
+                #there should always be points in a bin in a full point cloud, but highly thinned ones
+                #might be missing points in a bin
+                if numpy.isfinite(bin_heights[i]):
+                    height = bin_heights[i]
+
+                if height < minimum_height:
+                    height = 0
+
+                coordinates.append(utm_to_wgs.transform(
+                    self.ends[0][0] + i*contour_x_step,
+                    self.ends[0][1] + i*contour_y_step,
+                    height
+                ))
+
+        #a bin is flagged when its lowest few points sit well below the rest, which is usually a
+        #bird, wire or noise rather than the structure
+        flagged = []
+
+        if "kth_lowest" in statistics:
+            for i in numpy.flatnonzero(statistics["kth_lowest"] - statistics["minimum"] > flag_tolerance):
+                flagged.append({
+                    "step": int(i) if direction == Direction.WEST_TO_EAST else steps - 1 - int(i),
+                    "count": int(statistics["count"][i]),
+                    "minimum": float(statistics["minimum"][i]),
+                    "kth_lowest": float(statistics["kth_lowest"][i]),
+                    "height": float(bin_heights[i])
+                })
 
         if direction == Direction.EAST_TO_WEST:
             coordinates.reverse()
+            flagged.reverse()
 
         self.contour = coordinates
+        self.flagged_bins = flagged
+        self.clearance = ClearanceIndex([coordinate[2] for coordinate in coordinates])
+
+        length = abs(r_ends[1][0] - r_ends[0][0])
+        levels = []
+
+        for level, tolerance in enumerate(levels_of_detail, start=1):
+            levels.append(self.create_simplified_contour(level_of_detail_path(contour_file, level), tolerance, length))
+
+        lanes = None
+        if len(lane_offsets) > 0:
+            lanes = self.create_lanes(lanes_path(contour_file), xyz, r_ends, steps, lane_offsets, lane_width, minimum_height, direction,
+                utm_to_wgs)
 
         contour_geojson = {
             "type": "FeatureCollection", 
             "features": [{
                 "type": "Feature", 
-                "properties": { "length": abs(r_ends[1][0] - r_ends[0][0])},
+                "properties": {
+                    "length": length,
+                    "flagged": flagged,
+                    "clearance": self.clearance.to_json(),
+                    "levels_of_detail": levels,
+                    "lanes": lanes
+                },
                 "geometry": { 
                     "type": "MultiLineString", "coordinates": [coordinates]
                 }
@@ -147,7 +710,156 @@ class AirGapPoints():
         with open(contour_file, "w") as f:
             json.dump(contour_geojson, f)
 
-        self.rotate_points(angle, clockwise=False)
+        if rotated:
+            self.rotate_points(angle, clockwise=False)
+
+    def lane_minima(self, xyz, r_ends, steps, offsets, lane_width):
+        #the corridor is cut into slices wherever a lane starts or ends, so every point lands in at
+        #most one slice even when lanes overlap. One grouped pass finds the minimum of every bin of
+        #every slice, and each lane is then the lowest of the slices it covers.
+        offsets = numpy.asarray(offsets, dtype=float)
+        edges = numpy.unique(numpy.concatenate([offsets - lane_width/2, offsets + lane_width/2]))
+
+        r_contour_points = self.contour_points(xyz, r_ends, steps)
+
+        bins = r_contour_points[:,0].astype(numpy.int64)
+        slices = numpy.searchsorted(edges, r_contour_points[:,1] - r_ends[0][1], side="right") - 1
+        in_range = (bins >= 0) & (bins < steps) & (slices >= 0) & (slices < len(edges) - 1)
+
+        minima = numpy.full((len(edges) - 1) * steps, numpy.inf)
+        numpy.minimum.at(minima, slices[in_range] * steps + bins[in_range], r_contour_points[in_range,2])
+        minima = minima.reshape(-1, steps)
+
+        first = numpy.searchsorted(edges, offsets - lane_width/2)
+        last = numpy.searchsorted(edges, offsets + lane_width/2)
+
+        return numpy.array([minima[f:l].min(axis=0) for f, l in zip(first, last)])
+
+    def create_lanes(self, lanes_file, xyz, r_ends, steps, offsets, lane_width, minimum_height, direction, utm_to_wgs):
+        #offsets are meters to the left of the line from the western to the eastern end point. The
+        #lanes always use the minimum, and empty bins carry the previous height like the contour.
+        lane_heights = self.lane_minima(xyz, r_ends, steps, offsets, lane_width)
+
+        #a lane outside the points, or outside the corridor of a bridge, would be blocked everywhere
+        #and make the whole envelope 0, so it is left out
+        has_points = numpy.isfinite(lane_heights).any(axis=1)
+
+        if not has_points.all():
+            lm("Skipping lanes with no points at offsets: " + ", ".join(str(offset) for offset in numpy.asarray(offsets)[~has_points]))
+
+        if not has_points.any():
+            return None
+
+        offsets = [offset for offset, kept in zip(offsets, has_points) if kept]
+        lane_heights = lane_heights[has_points]
+
+        carried = numpy.maximum.accumulate(numpy.where(numpy.isfinite(lane_heights), numpy.arange(steps), 0), axis=1)
+        lane_heights = numpy.take_along_axis(lane_heights, carried, axis=1)
+        lane_heights[~numpy.isfinite(lane_heights) | (lane_heights < minimum_height)] = 0
+
+        envelope = lane_heights.min(axis=0)
+
+        dx = self.ends[1][0] - self.ends[0][0]
+        dy = self.ends[1][1] - self.ends[0][1]
+        span = math.hypot(dx, dy)
+
+        steps_x = self.ends[0][0] + numpy.arange(steps) * dx/steps
+        steps_y = self.ends[0][1] + numpy.arange(steps) * dy/steps
+
+        #the envelope is the lowest lane at each step and is drawn along the line between the end points
+        profiles = [({"offset": float(offset), "envelope": False}, heights) for offset, heights in zip(offsets, lane_heights)]
+        profiles.append(({"offset": 0.0, "envelope": True, "offsets": [float(offset) for offset in offsets]}, envelope))
+
+        features = []
+
+        for properties, heights in profiles:
+            offset = properties["offset"]
+            longitude, latitude, height = utm_to_wgs.transform(steps_x - offset * dy/span, steps_y + offset * dx/span, heights)
+            coordinates = [[float(x), float(y), float(z)] for x, y, z in zip(longitude, latitude, height)]
+
+            if direction == Direction.EAST_TO_WEST:
+                coordinates.reverse()
+
+            properties.update({
+                "lane_width": lane_width,
+                "clearance": ClearanceIndex([coordinate[2] for coordinate in coordinates]).to_json()
+            })
+
+            features.append({
+                "type": "Feature",
+                "properties": properties,
+                "geometry": {
+                    "type": "MultiLineString", "coordinates": [coordinates]
+                }
+            })
+
+        with open(lanes_file, "w") as f:
+            json.dump({"type": "FeatureCollection", "features": features}, f)
+
+        self.lanes = lane_heights[:, ::-1] if direction == Direction.EAST_TO_WEST else lane_heights
+        self.envelope = self.lanes.min(axis=0)
+
+        return {"file": os.path.basename(lanes_file), "offsets": [float(offset) for offset in offsets], "lane_width": lane_width}
+
+    def contour_points(self, xyz, r_ends, steps):
+        r_step = (r_ends[1][0] - r_ends[0][0])/steps
+
+        r_contour_points = xyz[numpy.logical_and(
+            xyz[:,0] >= r_ends[0][0],
+            xyz[:,0] <= r_ends[1][0]
+        )]
+
+        r_contour_points -= [r_ends[0][0], 0, 0]
+        r_contour_points /= [r_step, 1, 1]
+        r_contour_points[:,0] = numpy.floor(r_contour_points[:,0])
+
+        return r_contour_points
+
+    def bin_minima(self, steps, minimum_height=20, refine_ends=True, processes=1):
+        angle, r_ends, xyz, rotated = self.enter_frame(minimum_height, refine_ends and not self.refined_ends)
+
+        r_contour_points = self.contour_points(xyz, r_ends, steps)
+
+        if processes > 1:
+            from .parallel import parallel_minima
+
+            minima = parallel_minima(r_contour_points, steps, processes=processes)
+        else:
+            bins = r_contour_points[:,0].astype(numpy.int64)
+            in_range = (bins >= 0) & (bins < steps)
+
+            minima = numpy.full(steps, numpy.inf)
+            numpy.minimum.at(minima, bins[in_range], r_contour_points[in_range,2])
+
+        if rotated:
+            self.rotate_points(angle, clockwise=False)
+
+        return minima
+
+    def create_simplified_contour(self, contour_file, tolerance, length):
+        #steps holds the column of each kept vertex, so clients can map the vertices back to pixels
+        steps = simplify_heights(self.clearance.heights, tolerance).tolist()
+
+        contour_geojson = {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "properties": {
+                    "length": length,
+                    "width": len(self.contour),
+                    "tolerance": tolerance,
+                    "steps": steps
+                },
+                "geometry": {
+                    "type": "MultiLineString", "coordinates": [[self.contour[step] for step in steps]]
+                }
+            }]
+        }
+
+        with open(contour_file, "w") as f:
+            json.dump(contour_geojson, f)
+
+        return {"file": os.path.basename(contour_file), "tolerance": tolerance, "vertices": len(steps)}
 
     def create_depth(self, depth_file, layer, steps=1000, padding_left=0, padding_right=0, ends=None, direction=Direction.WEST_TO_EAST, band=1):
         if ends == None:
@@ -188,58 +900,79 @@ class AirGapPoints():
 
             depths.append(float(value))
 
+        self.set_depths(depth_file, depths)
+
+    def set_depths(self, depth_file, depths):
         self.depths = depths
 
         self.maximum_depth = min(depths)
-    
-        with open(depth_file, "w") as f:
-            json.dump(depths, f)
 
-    def create_image(self, image_file, width=1000, padding_left=0, padding_bottom=0, padding_right=0, black_and_white=False, maximum_depth=None, minimum_height=20, direction=Direction.WEST_TO_EAST, refine_ends=True, progress_bar = None, bar_steps = 50):
+        if depth_file:
+            with open(depth_file, "w") as f:
+                json.dump(depths, f)
+
+    def create_image(self, image_file, width=1000, padding_left=0, padding_bottom=0, padding_right=0, black_and_white=False, maximum_depth=None, minimum_height=20, direction=Direction.WEST_TO_EAST, refine_ends=True, decimate=False, processes=1, maximum_height=None, candidates=None, progress_bar = None, bar_steps = 50):
 
         if maximum_depth == None:
             maximum_depth = self.maximum_depth
 
-        red = self.points.red
-        green = self.points.green
-        blue = self.points.blue
-
-        angle = math.atan((self.ends[1][1] - self.ends[0][1])/(self.ends[1][0] - self.ends[0][0]))
-        self.rotate_points(angle, clockwise=True)
-        r_ends = self.rotate_ends(angle, self.ends, clockwise=True)
-
-        if refine_ends and not self.refined_ends:
-            refinement_condition = lambda x: x >= minimum_height
-            r_ends = self.refine_ends(r_ends, angle, refinement_condition)
+        angle, r_ends, xyz, rotated = self.enter_frame(minimum_height, refine_ends and not self.refined_ends)
 
-        scale = (r_ends[1][0] - r_ends[0][0])/(width)
+        scale, in_image, x_minimum, z_minimum = self.image_frame(xyz, r_ends, width, padding_left, padding_right)
 
         padding_bottom += int(-maximum_depth / scale)
 
-        west_x = r_ends[0][0] - padding_left * scale
-        east_x = r_ends[1][0] + padding_right * scale
-
-        image_points = self.points[numpy.where(
-            (self.points.x >= west_x) &
-            (self.points.x <= east_x)
-        )[0]]
+        #candidates limits the drawing to the points from visible_points, but the image is still
+        #sized by all of the points so it lines up with a full drawing
+        if candidates is None:
+            image_indices = numpy.flatnonzero(in_image)
+        else:
+            image_indices = candidates[in_image[candidates]]
 
-        image_xyz = image_points.xyz
-        image_r = (image_points.red / 65536) * 256
-        image_g = (image_points.green / 65536) * 256
-        image_b = (image_points.blue / 65536) * 256
+        image_xyz = xyz[image_indices]
+        image_r = (self.points.red[image_indices] / 65536) * 256
+        image_g = (self.points.green[image_indices] / 65536) * 256
+        image_b = (self.points.blue[image_indices] / 65536) * 256
 
-        image_xyz[:,0] -= numpy.min(image_xyz[:,0])
+        image_xyz[:,0] -= x_minimum
         image_xyz[:,0] /= scale
         image_xyz[:,0] = numpy.floor(image_xyz[:,0])
 
-        image_xyz[:,2] -= numpy.min(image_xyz[:,2])
+        image_xyz[:,2] -= z_minimum
         image_xyz[:,2] /= scale
         image_xyz[:,2] = numpy.floor(image_xyz[:,2])
         image_xyz[:,2] += padding_bottom
 
-        x_width = int(numpy.max(image_xyz[:,0]) + 1)
-        y_width = int(numpy.max(image_xyz[:,2]) + 1)
+        x_width = int(numpy.floor((numpy.max(xyz[in_image,0]) - x_minimum) / scale) + 1)
+        y_width = int(numpy.floor((numpy.max(xyz[in_image,2]) - z_minimum) / scale) + padding_bottom + 1)
+
+        #towers and masts far above the air gap would otherwise size the grids, so optionally
+        #stop the image at a fixed height above the minimum height. The width is left alone.
+        if maximum_height:
+            top = padding_bottom + int((minimum_height + maximum_height) / scale)
+            in_extent = image_xyz[:,2] <= top
+
+            image_xyz = image_xyz[in_extent]
+            image_indices = image_indices[in_extent]
+            image_r = image_r[in_extent]
+            image_g = image_g[in_extent]
+            image_b = image_b[in_extent]
+
+            y_width = min(y_width, top + 1)
+
+        kept = None
+        if processes > 1:
+            from .parallel import parallel_nearest
+
+            kept = parallel_nearest(image_xyz, x_width, nearest_maximum=direction == Direction.EAST_TO_WEST, processes=processes)
+        elif decimate:
+            kept = decimate_points(image_xyz, x_width, direction=direction)
+
+        if kept is not None:
+            image_xyz = image_xyz[kept]
+            image_r = image_r[kept]
+            image_g = image_g[kept]
+            image_b = image_b[kept]
 
         if black_and_white:
             color_grid = numpy.ones([y_width, x_width], dtype=bool)
@@ -251,8 +984,17 @@ class AirGapPoints():
         else:
             closest_y = numpy.full([y_width, x_width], numpy.min(image_xyz[:,1])-1, dtype=numpy.float32)
 
-        color_grid = find_color(color_grid, closest_y, image_xyz, image_r, image_g, image_b, black_and_white=black_and_white, 
-            direction=direction, progress_bar = progress_bar, bar_steps=bar_steps)
+        if self.engine == Engine.NUMPY:
+            from . import kernels
+
+            color_grid = kernels.find_color(color_grid, closest_y, image_xyz, image_r, image_g, image_b, black_and_white=black_and_white,
+                nearest_maximum=direction == Direction.EAST_TO_WEST)
+
+            if progress_bar:
+                progress_bar.setValue(progress_bar.value() + bar_steps)
+        else:
+            color_grid = find_color(color_grid, closest_y, image_xyz, image_r, image_g, image_b, black_and_white=black_and_white, 
+                direction=direction, progress_bar = progress_bar, bar_steps=bar_steps)
 
         color_height = int(minimum_height / scale)
 
@@ -264,25 +1006,102 @@ class AirGapPoints():
         if direction == Direction.WEST_TO_EAST:
             color_grid = numpy.fliplr(color_grid)
 
+        from PIL import Image
+
         image = Image.fromarray(color_grid).rotate(180)
 
-        self.rotate_points(angle, clockwise=False)
+        if rotated:
+            self.rotate_points(angle, clockwise=False)
 
         return scale, padding_bottom, image
 
+    def image_frame(self, xyz, r_ends, width, padding_left, padding_right):
+        scale = (r_ends[1][0] - r_ends[0][0])/(width)
+
+        west_x = r_ends[0][0] - padding_left * scale
+        east_x = r_ends[1][0] + padding_right * scale
+
+        in_image = (xyz[:,0] >= west_x) & (xyz[:,0] <= east_x)
+
+        return scale, in_image, numpy.min(xyz[in_image,0]), numpy.min(xyz[in_image,2])
+
+    def visible_points(self, frames, direction=Direction.WEST_TO_EAST, minimum_height=20, refine_ends=True):
+        #frames is a list of width, padding_left and padding_right. The pixels of every width are
+        #split along the edges of the pixels of the others, and the points that can win the depth
+        #test in each of those pieces are kept. Every pixel at every width is made of whole pieces,
+        #so the point that wins a pixel is always kept and drawing only these points gives the same
+        #images.
+        angle, r_ends, xyz, rotated = self.enter_frame(minimum_height, refine_ends and not self.refined_ends)
+
+        pieces = numpy.zeros(len(xyz), dtype=numpy.int64)
+
+        for width, padding_left, padding_right in frames:
+            scale, in_image, x_minimum, z_minimum = self.image_frame(xyz, r_ends, width, padding_left, padding_right)
+
+            #the same arithmetic as create_image so the pixels match exactly, with the points outside
+            #the image in a pixel of their own
+            columns = numpy.floor((xyz[:,0] - x_minimum) / scale).astype(numpy.int64) + 1
+            rows = numpy.floor((xyz[:,2] - z_minimum) / scale).astype(numpy.int64)
+            columns[~in_image] = 0
+            rows[~in_image] = 0
+
+            cells = rows * (numpy.max(columns) + 1) + columns
+            pieces = numpy.unique(pieces * (numpy.max(cells) + 1) + cells, return_inverse=True)[1].reshape(-1)
+
+        if direction == Direction.WEST_TO_EAST:
+            depth = xyz[:,1]
+        else:
+            depth = -xyz[:,1]
+
+        from .parallel import nearest_points
+
+        visible = nearest_points(pieces, depth)
+
+        if rotated:
+            self.rotate_points(angle, clockwise=False)
+
+        return visible
+
+    def prepare_frame(self, minimum_height=20, refine_ends=True):
+        #rotates and refines once up front, so the stages after it only read shared state and can
+        #run at the same time. The points are left rotated rather than copied and rotated back,
+        #which would hold a second copy of the cloud.
+        angle, r_ends, xyz, rotated = self.enter_frame(minimum_height, refine_ends and not self.refined_ends)
+
+        self.frame = (angle, r_ends, xyz)
+
+    def enter_frame(self, minimum_height, refine_ends):
+        if self.frame:
+            return *self.frame, False
+
+        angle = math.atan((self.ends[1][1] - self.ends[0][1])/(self.ends[1][0] - self.ends[0][0]))
+        self.rotate_points(angle, clockwise=True)
+        r_ends = self.rotate_ends(angle, self.ends, clockwise=True)
+
+        if refine_ends:
+            refinement_condition = lambda x: x >= minimum_height
+            r_ends = self.refine_ends(r_ends, angle, refinement_condition)
+
+        return angle, r_ends, self.xyz, True
+
     def refine_ends(self, r_ends, r_angle, refinement_condition, granularity=0.1):
         refined_west = r_ends[0][0]
         refined_east = r_ends[1][0]
 
-        while not refinement_condition(height := numpy.min(
-            self.xyz[numpy.logical_and(self.xyz[:,0] >= refined_west, self.xyz[:,0] < refined_west + granularity)][:,2]
-        )):
-            refined_west += granularity
+        if self.engine == Engine.NUMPY:
+            from . import kernels
+
+            refined_west, refined_east = kernels.refine_ends(self.xyz[:,0], self.xyz[:,2], refined_west, refined_east, refinement_condition, granularity)
+        else:
+            while not refinement_condition(height := numpy.min(
+                self.xyz[numpy.logical_and(self.xyz[:,0] >= refined_west, self.xyz[:,0] < refined_west + granularity)][:,2]
+            )):
+                refined_west += granularity
 
-        while not refinement_condition(height := numpy.min(
-            self.xyz[numpy.logical_and(self.xyz[:,0] >= refined_east, self.xyz[:,0] < refined_east + granularity)][:,2]
-        )):
-            refined_east -= granularity
+            while not refinement_condition(height := numpy.min(
+                self.xyz[numpy.logical_and(self.xyz[:,0] >= refined_east, self.xyz[:,0] < refined_east + granularity)][:,2]
+            )):
+                refined_east -= granularity
 
         r_ends = [[refined_west, r_ends[0][1]], [refined_east, r_ends[1][1]]]
         self.ends = self.rotate_ends(r_angle, r_ends, clockwise=False)
@@ -291,6 +1110,11 @@ class AirGapPoints():
         return r_ends
 
     def average_and_color(self, extract_ranges, color, draw_lower = True, alpha = 255):
+        if self.engine == Engine.NUMPY:
+            from . import kernels
+
+            return kernels.average_and_color(extract_ranges, color, draw_lower, alpha)
+
         group_for_color = color[
             extract_ranges[0][0]:extract_ranges[0][1], 
             extract_ranges[1][0]:extract_ranges[1][1]
@@ -338,6 +1162,11 @@ class AirGapPoints():
         ] = group_for_color
 
     def color_obstructions(self, colors, padding_left, padding_bottom, padding_right, color_height):
+        if self.engine == Engine.NUMPY:
+            from . import kernels
+
+            return kernels.color_obstructions(colors, padding_left, padding_bottom, padding_right, color_height)
+
         yl, xl = colors.shape[:2]
 
         start_i = None
@@ -354,6 +1183,8 @@ class AirGapPoints():
             self.average_and_color([[padding_bottom, padding_bottom+color_height],[start_i, i]], colors)
 
     def rotate_ends(self, angle, ends, clockwise=False):
+        from scipy.spatial.transform import Rotation
+
         if clockwise:
             angle = -angle
 
@@ -367,6 +1198,8 @@ class AirGapPoints():
         return [[points[0][0], points[0][1]], [points[1][0], points[1][1]]]
 
     def rotate_points(self, angle, clockwise=False):
+        from scipy.spatial.transform import Rotation
+
         if clockwise:
             angle = -angle
 
@@ -375,5 +1208,3 @@ class AirGapPoints():
         self.xyz -= self.mins
         self.xyz = rotation.apply(self.xyz)
         self.xyz += self.mins
-
-        self.points.xyz = self.xyz
@@ -5,22 +5,28 @@ from qgis.core import *
 
 # Initialize Qt resources from file resources.py
 from .resources import *
-# Import the code for the dialog
-from .airgap_vis_dialog import AirGapVisDialog
-from .simulated_visualization import SimVisDialog
 import os.path
-from PIL import Image, ImageQt, ImageEnhance
 
-import laspy
-import numpy
 import os
 import sys
+import tempfile
 
-from .airgap import *
+from .cache import PointCloudCache
+from .options import ContourStatistic, Direction, Engine
+
+#numpy, the generation code, PIL and the dialogs, which load their .ui files when imported, are
+#imported on first use so that they are not loaded at QGIS startup for sessions that never open
+#the plugin
 
 POINT_TYPE = QgsWkbTypes.PointGeometry
 LINE_TYPE = QgsWkbTypes.LineGeometry
 
+PREVIEW_WIDTH = 250
+PREVIEW_POINTS = 500000
+PREVIEW_CORRIDOR_WIDTH = 100
+
+POINT_CLOUD_CACHE_BYTES = 4 * 1024**3
+
 def lm(message):
     QgsMessageLog.logMessage(str(message))
 
@@ -30,11 +36,54 @@ def info(message):
 def warning(message):
     QMessageBox.warning(None, "", str(message))
 
+def preview_settings(settings, preview_width):
+    if settings["width"] <= preview_width:
+        return settings
+
+    #padding is in pixels, so it shrinks along with the width to keep the same framing
+    ratio = preview_width / settings["width"]
+
+    settings = settings.copy()
+    settings["width"] = preview_width
+    settings["padding_left"] = int(settings["padding_left"] * ratio)
+    settings["padding_right"] = int(settings["padding_right"] * ratio)
+    settings["padding_bottom"] = int(settings["padding_bottom"] * ratio)
+    settings["widths"] = ()
+
+    return settings
+
+def parse_numbers(text, number_type=float, keep=lambda number: number > 0):
+    #numbers separated by commas or spaces, anything that is not a number or is not kept is ignored
+    numbers = []
+
+    for value in text.replace(",", " ").split():
+        try:
+            number = number_type(value)
+        except ValueError:
+            continue
+
+        if keep(number):
+            numbers.append(number)
+
+    return sorted(set(numbers))
+
+def generate_task(task, point_cloud_path, end_points, contour_path, depth_path, bathymetry_source, settings, cache):
+    #runs on a QgsTask worker thread, so the layers used here must not be shared with the main thread
+    from .airgap import cached_read_points, generate_visualization
+
+    points = cached_read_points(point_cloud_path, cache)
+
+    bathymetry_layer = None
+    if bathymetry_source:
+        bathymetry_layer = QgsRasterLayer(bathymetry_source[0], "", bathymetry_source[1])
+
+    return generate_visualization(points, end_points, contour_path, depth_path=depth_path, bathymetry_layer=bathymetry_layer, **settings)
+
 class AirGapVis:
     def __init__(self, iface):
         self.iface = iface
         self.plugin_dir = os.path.dirname(__file__)
-        locale = QSettings().value('locale/userLocale')[0:2]
+        locale = QSettings().value('locale/userLocale', 'en')[0:2]
         locale_path = os.path.join(
             self.plugin_dir,
             'i18n',
@@ -62,6 +111,7 @@ class AirGapVis:
         }
         self.west_east_background_path = None
         self.east_west_background_path = None
+        self.variant_images = {}
 
         self.width = None
         self.minimum_height = None
@@ -71,6 +121,14 @@ class AirGapVis:
         self.refine_ends = None
         self.direction = Direction.WEST_TO_EAST
 
+        self.preview_dir = None
+        self.task = None
+
+        self.point_cache = PointCloudCache(POINT_CLOUD_CACHE_BYTES)
+        self.layer_sources = {}
+        self.end_point_indexes = {}
+        self.watched_layers = set()
+
         self.enhancement_steps = 10
 
         self.adjustments = {
@@ -154,6 +212,8 @@ class AirGapVis:
         # will be set False in run()
         self.first_start = True
 
+        QgsProject.instance().layersWillBeRemoved.connect(self.layers_removed)
+
 
     def unload(self):
         for action in self.actions:
@@ -162,6 +222,18 @@ class AirGapVis:
                 action)
             self.iface.removeToolBarIcon(action)
 
+        QgsProject.instance().layersWillBeRemoved.disconnect(self.layers_removed)
+        self.point_cache.clear()
+
+    def layers_removed(self, layer_ids):
+        for layer_id in layer_ids:
+            self.end_point_indexes.pop(layer_id, None)
+            self.watched_layers.discard(layer_id)
+
+            if layer_id in self.layer_sources:
+                self.point_cache.invalidate(self.layer_sources.pop(layer_id))
+                lm(f"Point cloud cache entry removed with its layer: {self.point_cache.statistics()}")
+
     def select_contour_file(self):
         filename, file_filter = QFileDialog.getSaveFileName(self.dlg, "Select Contour File Name")
 
@@ -213,19 +285,39 @@ class AirGapVis:
         else:
             self.dlg.bathymetryComboBox.setEnabled(False)
 
-    def determine_end_points(self, point_cloud, vector_layer):
+    def end_point_index(self, layer):
+        #built once per layer and reused, with the geometries stored in the index so the exact test
+        #does not need to fetch features
+        if layer.id() not in self.end_point_indexes:
+            request = QgsFeatureRequest().setNoAttributes()
+            self.end_point_indexes[layer.id()] = QgsSpatialIndex(layer.getFeatures(request), None, QgsSpatialIndex.FlagStoreFeatureGeometries)
+
+        #the index is rebuilt after every edit, but the layer only needs to be connected once
+        if layer.id() not in self.watched_layers:
+            self.watched_layers.add(layer.id())
+            layer.dataChanged.connect(lambda layer_id=layer.id(): self.end_point_indexes.pop(layer_id, None))
+
+        return self.end_point_indexes[layer.id()]
+
+    def end_points_in_bounds(self, point_cloud, vector_layer):
         point_cloud_bounds = point_cloud.layer().dataProvider().polygonBounds()
-        
-        points = []
+        index = self.end_point_index(vector_layer.layer())
+
+        engine = QgsGeometry.createGeometryEngine(point_cloud_bounds.constGet())
+        engine.prepareGeometry()
 
-        for feature in vector_layer.layer().getFeatures():
-            geometry = feature.geometry()
+        points = {}
+
+        for feature_id in index.intersects(point_cloud_bounds.boundingBox()):
+            geometry = index.geometry(feature_id)
 
             if geometry.type() == POINT_TYPE and QgsWkbTypes.isSingleType(geometry.wkbType()):
-                point = geometry.asPoint()
-                if point_cloud_bounds.intersects(geometry):
-                    points.append(point)
+                if engine.intersects(geometry.constGet()):
+                    points[feature_id] = geometry.asPoint()
+
+        return points
 
+    def order_end_points(self, points):
         if len(points) > 2:
             return [], "Unable to determine end points. Too many points within point cloud bounds."
         elif len(points) < 2:
@@ -236,7 +328,36 @@ class AirGapVis:
             else:
                 return [[points[0].x(), points[0].y()],[points[1].x(),points[1].y()]], None
 
+    def determine_end_points(self, point_cloud, vector_layer):
+        return self.order_end_points(list(self.end_points_in_bounds(point_cloud, vector_layer).values()))
+
+    def determine_bridge_end_points(self, point_cloud, vector_layer, bridge_field):
+        #the end points of every bridge within the point cloud, grouped by bridge_field, from a
+        #single lookup. Returns a dictionary of bridge ID to end points and error.
+        points = self.end_points_in_bounds(point_cloud, vector_layer)
+
+        layer = vector_layer.layer()
+        request = QgsFeatureRequest().setFilterFids(list(points.keys()))
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([bridge_field], layer.fields())
+
+        bridges = {}
+
+        for feature in layer.getFeatures(request):
+            bridge = feature[bridge_field]
+
+            #an end point without an ID cannot be paired or named, so it is left out
+            if bridge == None or bridge == NULL:
+                lm(f"Skipping end point {feature.id()}: no value in {bridge_field}")
+                continue
+
+            bridges.setdefault(bridge, []).append(points[feature.id()])
+
+        return {bridge: self.order_end_points(bridge_points) for bridge, bridge_points in bridges.items()}
+
     def color_image(self, point_cloud, image, scale, padding_left, padding_right, padding_bottom, direction):
+        import numpy
+
         pixmap = QPixmap(image.width(), image.height())
         pixmap.fill(Qt.white)
         
@@ -264,15 +385,19 @@ class AirGapVis:
                 painter.fillRect(i, y + depth_height, 1, padding_bottom - depth_height, QColor.fromRgbF(0,0,0,0.75))
 
         if self.sim_vis.vesselHeightSpinBox.value() > 0:
+            passable = numpy.zeros(len(contour), dtype=bool)
+
+            for start, end in point_cloud.clearance.spans(self.sim_vis.vesselHeightSpinBox.value(), reverse=direction != self.direction):
+                passable[start:end+1] = True
+
             previous_contour_height = 0
 
             x = padding_left
             for i in range(len(contour)):
-                contour_meters = contour[i][2]
                 contour_height = int(contour[i][2]/scale)
     
                 if contour_height > 0: 
-                    if self.sim_vis.vesselHeightSpinBox.value() < contour_meters:
+                    if passable[i]:
                         painter.fillRect(x+i, y - contour_height, 1, contour_height, QColor.fromRgbF(0,1,0,0.75))
                     else:
                         painter.fillRect(x+i, y - contour_height, 1, contour_height, QColor.fromRgbF(1,0,0,0.75))
@@ -303,10 +428,28 @@ class AirGapVis:
         self.adjustment_changed(value, "sharpness")
 
     def visualization_option_changed(self, value):
+        self.update_clearance_label()
         self.update_simulated_visualization(Direction.EAST_TO_WEST)
         self.update_simulated_visualization(Direction.WEST_TO_EAST)
 
+    def update_clearance_label(self):
+        vessel_height = self.sim_vis.vesselHeightSpinBox.value()
+
+        if vessel_height > 0:
+            widest = self.point_cloud.clearance.widest_opening(vessel_height)
+            widest_width = 0 if widest == None else (widest[1] - widest[0] + 1) * self.scale
+            passable_width = self.point_cloud.clearance.passable_width(vessel_height) * self.scale
+
+            self.sim_vis.clearanceLabel.setText(f"Widest Opening: {widest_width:.1f}m  Passable Width: {passable_width:.1f}m")
+        else:
+            self.sim_vis.clearanceLabel.setText("")
+
     def enhance_image(self, direction):
+        from PIL import Image, ImageQt
+        import numpy
+
+        from .airgap import apply_adjustments
+
         original_image = self.images[direction.value]["original"]
         adjustments = self.adjustments[direction.value]
 
@@ -318,18 +461,7 @@ class AirGapVis:
         image_data.setsize(height*width*4)
 
         image = Image.fromarray(numpy.array(image_data).reshape(height, width, 4))
-        
-        brightness_enhancer = ImageEnhance.Brightness(image)
-        image = brightness_enhancer.enhance(adjustments["brightness"])
-
-        contrast_enhancer = ImageEnhance.Contrast(image)
-        image = contrast_enhancer.enhance(adjustments["contrast"])
-
-        saturation_enhancer = ImageEnhance.Color(image)
-        image = saturation_enhancer.enhance(adjustments["saturation"])
-
-        sharpness_enhancer = ImageEnhance.Sharpness(image)
-        image = sharpness_enhancer.enhance(adjustments["sharpness"])
+        image = apply_adjustments(image, adjustments)
 
         self.images[direction.value]["enhanced"] = ImageQt.ImageQt(image)
 
@@ -337,24 +469,86 @@ class AirGapVis:
         pixmap = self.color_image(self.point_cloud, self.images[direction.value]["enhanced"], self.scale, self.padding_left, self.padding_right, self.adjusted_padding_bottom, direction)
         self.imageLabels[direction.value].setPixmap(pixmap)
 
-    def generate(self):
+    def generation_settings(self):
+        return {
+            "width": self.dlg.widthSpinBox.value(),
+            "minimum_height": self.dlg.minimumHeightSpinBox.value(),
+            "padding_left": self.dlg.paddingLeftSpinBox.value(),
+            "padding_right": self.dlg.paddingLeftSpinBox.value(),
+            "padding_bottom": self.dlg.paddingBottomSpinBox.value(),
+            "refine_ends": self.dlg.refineEndsCheckBox.isChecked(),
+            "decimate": self.dlg.decimateCheckBox.isChecked(),
+            "processes": self.dlg.processesSpinBox.value(),
+            "threads": self.dlg.threadsSpinBox.value(),
+            "statistic": ContourStatistic(self.dlg.contourStatisticComboBox.currentData()),
+            "percentile": self.dlg.percentileSpinBox.value(),
+            "kth_lowest": self.dlg.kthLowestSpinBox.value(),
+            "flag_tolerance": self.dlg.flagToleranceSpinBox.value(),
+            "maximum_height": self.dlg.maximumHeightSpinBox.value(),
+            "levels_of_detail": parse_numbers(self.dlg.contourLevelsOfDetailLineEdit.text()),
+            "widths": parse_numbers(self.dlg.additionalWidthsLineEdit.text(), int),
+            "lane_offsets": parse_numbers(self.dlg.laneOffsetsLineEdit.text(), keep=lambda number: True),
+            "lane_width": self.dlg.laneWidthSpinBox.value(),
+            "engine": Engine(self.dlg.engineComboBox.currentData()),
+            "direction": self.direction,
+            "band": self.dlg.bandSpinBox.value(),
+            "point_filter": {
+                "include_classifications": parse_numbers(self.dlg.includeClassesLineEdit.text(), int, keep=lambda number: number >= 0),
+                "exclude_classifications": parse_numbers(self.dlg.excludeClassesLineEdit.text(), int, keep=lambda number: number >= 0),
+                "include_returns": parse_numbers(self.dlg.includeReturnsLineEdit.text(), int),
+                "exclude_returns": parse_numbers(self.dlg.excludeReturnsLineEdit.text(), int),
+                "minimum_intensity": self.dlg.minimumIntensitySpinBox.value(),
+                "maximum_intensity": self.dlg.maximumIntensitySpinBox.value()
+            }
+        }
+
+    def load_points(self, point_cloud_path):
+        from .airgap import cached_read_points
+
+        try:
+            return cached_read_points(point_cloud_path, self.point_cache)
+        except:
+            if point_cloud_path.endswith(".laz"):
+                warning("LAZ file support not found. Please install the laszip python package.")
+                return None
+            raise
+
+    def preview(self):
+        self.generate(preview=True)
+
+    def generate(self, preview=False):
+        from .airgap import corridor_margin, generate_visualization, subsample_points, within_corridor
+
         point_cloud_layer = self.point_clouds[self.dlg.pointCloudComboBox.currentIndex()]
         vector_layer = self.vector_layers[self.dlg.endPointsComboBox.currentIndex()]
         bathymetry_layer = self.raster_layers[self.dlg.bathymetryComboBox.currentIndex()]
 
         contour_path = self.dlg.contourLineEdit.text()
         depth_path = self.dlg.depthLineEdit.text()
-        west_east_background_path = self.dlg.westEastBackgroundLineEdit.text()
-        east_west_background_path = self.dlg.eastWestBackgroundLineEdit.text()
-
-        width = self.dlg.widthSpinBox.value()
-        minimum_height = self.dlg.minimumHeightSpinBox.value()
-        padding_left = self.dlg.paddingLeftSpinBox.value()
-        padding_right = self.dlg.paddingLeftSpinBox.value()
-        padding_bottom = self.dlg.paddingBottomSpinBox.value()
-        refine_ends = self.dlg.refineEndsCheckBox.isChecked()
-        direction = self.direction
-        band = self.dlg.bandSpinBox.value()
+        background_path = {
+            Direction.EAST_TO_WEST.value: self.dlg.eastWestBackgroundLineEdit.text(),
+            Direction.WEST_TO_EAST.value: self.dlg.westEastBackgroundLineEdit.text()
+        }
+
+        settings = self.generation_settings()
+
+        if preview:
+            #the preview never touches the output paths
+            if self.preview_dir == None:
+                self.preview_dir = tempfile.mkdtemp(prefix="airgap_vis_")
+            contour_path = os.path.join(self.preview_dir, "contour.json")
+            depth_path = os.path.join(self.preview_dir, "depth.json")
+            settings = preview_settings(settings, PREVIEW_WIDTH)
+
+        bridge_field = self.dlg.bridgeFieldLineEdit.text().strip()
+
+        if bridge_field and not preview:
+            if vector_layer.layer().fields().indexOf(bridge_field) == -1:
+                warning(f"The end points layer has no field named {bridge_field}.")
+                return
+
+            self.generate_bridges(point_cloud_layer, vector_layer, bathymetry_layer, bridge_field, contour_path, depth_path, background_path, settings)
+            return
 
         end_points, error = self.determine_end_points(point_cloud_layer, vector_layer)
 
@@ -362,71 +556,183 @@ class AirGapVis:
             QMessageBox.warning(None, "", error)
             return
 
+        if not self.dlg.createDepthFileCheckBox.isChecked():
+            bathymetry_layer = None
+
         point_cloud_path = point_cloud_layer.layer().dataProvider().dataSourceUri()
+        self.layer_sources[point_cloud_layer.layer().id()] = point_cloud_path
+
+        if not preview and self.dlg.backgroundCheckBox.isChecked():
+            self.generate_in_background(point_cloud_path, end_points, contour_path, depth_path, background_path, bathymetry_layer, settings)
+            return
 
         self.dlg.showSimulatedVisualizationsButton.hide()
         self.dlg.progressBar.setValue(0)
         self.dlg.progressBar.show()
 
-        if point_cloud_path.endswith(".laz"):
-            try:
-                l = laspy.open(point_cloud_path, laz_backend=laspy.LazBackend.Laszip)
-            except:
-                warning("LAZ file support not found. Please install the laszip python package.")
-                return
-        else:
-            l = laspy.open(point_cloud_path)
+        points = self.load_points(point_cloud_path)
 
-        points = l.read()
-        point_cloud = AirGapPoints(points, *end_points)
+        if points is None:
+            self.dlg.progressBar.hide()
+            return
 
-        point_cloud.create_contour(contour_path, minimum_height=minimum_height, steps=width, refine_ends=refine_ends, direction=direction, 
-            progress_bar = self.dlg.progressBar, bar_steps=33)
-        if self.dlg.createDepthFileCheckBox.isChecked():
-            point_cloud.create_depth(depth_path, bathymetry_layer.layer(), steps=width, 
-                padding_left=padding_left, padding_right=padding_right, direction=direction, band=band)
-        scale, adjusted_padding_bottom, ew_image = point_cloud.create_image(east_west_background_path, width=width, padding_left=padding_left, padding_right=padding_right, 
-            padding_bottom = padding_bottom, minimum_height=minimum_height, direction=Direction.EAST_TO_WEST, progress_bar = self.dlg.progressBar,
-            refine_ends=refine_ends, bar_steps=34)
-        scale, adjusted_padding_bottom, we_image = point_cloud.create_image(west_east_background_path, width=width, padding_left=padding_left, padding_right=padding_right, 
-            padding_bottom = padding_bottom, minimum_height=minimum_height, direction=Direction.WEST_TO_EAST, progress_bar = self.dlg.progressBar,
-            refine_ends=refine_ends, bar_steps=33)
+        if preview:
+            #only the bridge's corridor is subsampled, so a large cloud does not thin out the points
+            #near the bridge. The whole file is still read the first time, later previews and
+            #Generate take it from the cache.
+            corridor = within_corridor(points.xyz[:,:2], end_points, PREVIEW_CORRIDOR_WIDTH, corridor_margin(end_points, settings))
+            points = subsample_points(points[corridor], PREVIEW_POINTS)
+
+        if bathymetry_layer:
+            bathymetry_layer = bathymetry_layer.layer()
+
+        result = generate_visualization(points, end_points, contour_path, depth_path=depth_path, bathymetry_layer=bathymetry_layer,
+            progress_bar=self.dlg.progressBar, **settings)
+
+        self.show_results(result, contour_path, depth_path, background_path, settings, preview=preview)
 
-        l.close()
+    def generate_bridges(self, point_cloud_layer, vector_layer, bathymetry_layer, bridge_field, contour_path, depth_path, background_path, settings):
+        #every bridge in the point cloud is generated from one read of the points, with the bridge
+        #ID added to each output file name
+        from .airgap import bridge_path, generate_bridges
 
-        self.images[Direction.EAST_TO_WEST.value]["original"] = ImageQt.ImageQt(ew_image)
-        self.images[Direction.EAST_TO_WEST.value]["enhanced"] = ImageQt.ImageQt(ew_image)
+        bridges = {}
 
-        self.images[Direction.WEST_TO_EAST.value]["original"] = ImageQt.ImageQt(we_image)
-        self.images[Direction.WEST_TO_EAST.value]["enhanced"] = ImageQt.ImageQt(we_image)
+        for bridge, (end_points, error) in self.determine_bridge_end_points(point_cloud_layer, vector_layer, bridge_field).items():
+            if len(end_points) == 0:
+                lm(f"Skipping bridge {bridge}: {error}")
+                continue
+
+            bridges[bridge] = {
+                "end_points": end_points,
+                "contour": bridge_path(contour_path, bridge),
+                "depth": bridge_path(depth_path, bridge),
+                "images": {direction: bridge_path(path, bridge) for direction, path in background_path.items()}
+            }
+
+        if len(bridges) == 0:
+            warning("Unable to determine end points. No bridges with two end points within point cloud bounds.")
+            return
+
+        if not self.dlg.createDepthFileCheckBox.isChecked():
+            bathymetry_layer = None
+
+        if bathymetry_layer:
+            bathymetry_layer = bathymetry_layer.layer()
+
+        point_cloud_path = point_cloud_layer.layer().dataProvider().dataSourceUri()
+        self.layer_sources[point_cloud_layer.layer().id()] = point_cloud_path
+
+        self.dlg.showSimulatedVisualizationsButton.hide()
+        self.dlg.progressBar.setValue(0)
+        self.dlg.progressBar.show()
+
+        points = self.load_points(point_cloud_path)
+
+        if points is None:
+            self.dlg.progressBar.hide()
+            return
+
+        results = generate_bridges(points, bridges, bathymetry_layer=bathymetry_layer, progress_bar=self.dlg.progressBar, **settings)
+
+        lm(f"Generated {len(results)} bridges: " + ", ".join(str(bridge) for bridge in results))
+
+        #the images are already saved, so the first bridge is only shown
+        bridge = next(iter(results))
+        self.show_results(results[bridge], bridges[bridge]["contour"], bridges[bridge]["depth"], bridges[bridge]["images"], settings, save=False)
+
+    def generate_in_background(self, point_cloud_path, end_points, contour_path, depth_path, background_path, bathymetry_layer, settings):
+        bathymetry_source = None
+
+        if bathymetry_layer:
+            bathymetry_source = (bathymetry_layer.layer().source(), bathymetry_layer.layer().providerType())
+
+        self.dlg.generateButton.setEnabled(False)
+        self.dlg.previewButton.setEnabled(False)
+
+        on_finished = lambda exception, result=None: self.background_generation_finished(exception, result, contour_path, depth_path,
+            background_path, settings)
+
+        #QgsTask only holds a weak reference, so it is kept on the plugin until it finishes
+        self.task = QgsTask.fromFunction("Generating Air Gap Visualization", generate_task, point_cloud_path, end_points, contour_path,
+            depth_path, bathymetry_source, settings, self.point_cache, on_finished=on_finished)
+        QgsApplication.taskManager().addTask(self.task)
+
+    def background_generation_finished(self, exception, result, contour_path, depth_path, background_path, settings):
+        self.task = None
+        self.dlg.generateButton.setEnabled(True)
+        self.dlg.previewButton.setEnabled(True)
+
+        if exception:
+            warning(f"Generation failed: {exception}")
+            return
+
+        if result:
+            self.show_results(result, contour_path, depth_path, background_path, settings)
+
+    def show_results(self, result, contour_path, depth_path, background_path, settings, preview=False, save=True):
+        from PIL import ImageQt
+
+        point_cloud, scale, adjusted_padding_bottom, images, variants = result
+
+        for direction in Direction:
+            self.images[direction.value]["original"] = ImageQt.ImageQt(images[direction.value])
+            self.images[direction.value]["enhanced"] = ImageQt.ImageQt(images[direction.value])
 
         self.point_cloud = point_cloud
         self.scale = scale
 
+        if point_cloud.flagged_bins:
+            lm(f"{len(point_cloud.flagged_bins)} contour bins have isolated low points: " +
+                ", ".join(str(flagged["step"]) for flagged in point_cloud.flagged_bins))
+
         self.contour_path = contour_path
         self.depth_path = depth_path
-        self.background_path[Direction.EAST_TO_WEST.value] = east_west_background_path
-        self.background_path[Direction.WEST_TO_EAST.value] = west_east_background_path
-
-        self.width = width
-        self.minimum_height = minimum_height
-        self.padding_left = padding_left
-        self.padding_right = padding_right
-        self.padding_bottom = padding_bottom
+        self.background_path = background_path
+        self.variant_images = {width: variant["images"] for width, variant in variants.items()}
+
+        self.width = settings["width"]
+        self.minimum_height = settings["minimum_height"]
+        self.padding_left = settings["padding_left"]
+        self.padding_right = settings["padding_right"]
+        self.padding_bottom = settings["padding_bottom"]
         self.adjusted_padding_bottom = adjusted_padding_bottom
-        self.refine_ends = refine_ends
-        self.direction = direction
+        self.refine_ends = settings["refine_ends"]
+        self.direction = settings["direction"]
 
         self.dlg.progressBar.hide()
         self.dlg.showSimulatedVisualizationsButton.show()
 
-        self.enhance_image(Direction.EAST_TO_WEST)
-        self.update_simulated_visualization(Direction.EAST_TO_WEST)
-        self.images[Direction.EAST_TO_WEST.value]["enhanced"].save(self.background_path[Direction.EAST_TO_WEST.value])
+        self.update_clearance_label()
 
-        self.enhance_image(Direction.WEST_TO_EAST)
-        self.update_simulated_visualization(Direction.WEST_TO_EAST)
-        self.images[Direction.WEST_TO_EAST.value]["enhanced"].save(self.background_path[Direction.WEST_TO_EAST.value])
+        self.sim_vis.westEastSaveButton.setEnabled(not preview)
+        self.sim_vis.eastWestSaveButton.setEnabled(not preview)
+
+        directions = [Direction.EAST_TO_WEST, Direction.WEST_TO_EAST]
+
+        if settings["threads"] > 1:
+            #QImage and PIL are safe to use off the main thread, unlike the pixmaps drawn afterwards
+            from .scheduler import StageScheduler
+
+            scheduler = StageScheduler(settings["threads"])
+
+            for direction in directions:
+                scheduler.add(direction.value, lambda direction=direction: self.enhance_image(direction))
+
+                if save and not preview:
+                    scheduler.add(f"save {direction.value}", lambda direction=direction: self.save_image(direction), [direction.value])
+
+            scheduler.run(poll=QCoreApplication.processEvents)
+
+            for direction in directions:
+                self.update_simulated_visualization(direction)
+        else:
+            for direction in directions:
+                self.enhance_image(direction)
+                self.update_simulated_visualization(direction)
+
+                if save and not preview:
+                    self.save_image(direction)
 
         self.sim_vis.show()
         self.dlg.resize(self.dlg.size().width(), 1)
@@ -434,47 +740,74 @@ class AirGapVis:
     def reset_vessel_height(self):
         self.sim_vis.vesselHeightSpinBox.setValue(0)
 
+    def save_image(self, direction):
+        from .airgap import apply_adjustments, variant_path
+
+        self.images[direction.value]["enhanced"].save(self.background_path[direction.value])
+
+        #the other widths are saved with the same adjustments next to the main image
+        for width, images in self.variant_images.items():
+            apply_adjustments(images[direction.value], self.adjustments[direction.value]).save(
+                variant_path(self.background_path[direction.value], width))
+
     def save_adjusted_image(self):
         direction = self.sim_vis.sender().parentWidget().direction
-        self.images[direction.value]["enhanced"].save(self.background_path[direction.value])
+        self.save_image(direction)
+
+    def create_simulated_visualization(self, parent=None):
+        #kept apart from run so the redraw benchmark drives the same dialog and connections
+        from .simulated_visualization import SimVisDialog
+
+        self.sim_vis = SimVisDialog(parent=parent)
+        self.sim_vis.westEastGroupBox.direction = Direction.WEST_TO_EAST
+        self.sim_vis.eastWestGroupBox.direction = Direction.EAST_TO_WEST
+
+        self.imageLabels[Direction.EAST_TO_WEST.value] = self.sim_vis.eastWestImageLabel
+        self.imageLabels[Direction.WEST_TO_EAST.value] = self.sim_vis.westEastImageLabel
+
+        self.sim_vis.vesselHeightSpinBox.valueChanged.connect(self.visualization_option_changed)
+        self.sim_vis.clearButton.clicked.connect(self.reset_vessel_height)
+
+        self.sim_vis.bathymetryCheckBox.stateChanged.connect(self.visualization_option_changed)
+        self.sim_vis.waterCheckBox.stateChanged.connect(self.visualization_option_changed)
+
+        self.sim_vis.westEastBrightnessSlider.valueChanged.connect(self.brightness_changed)
+        self.sim_vis.eastWestBrightnessSlider.valueChanged.connect(self.brightness_changed)
+
+        self.sim_vis.westEastSaturationSlider.valueChanged.connect(self.saturation_changed)
+        self.sim_vis.eastWestSaturationSlider.valueChanged.connect(self.saturation_changed)
+
+        self.sim_vis.westEastSharpnessSlider.valueChanged.connect(self.sharpness_changed)
+        self.sim_vis.eastWestSharpnessSlider.valueChanged.connect(self.sharpness_changed)
+
+        self.sim_vis.westEastSaveButton.clicked.connect(self.save_adjusted_image)
+        self.sim_vis.eastWestSaveButton.clicked.connect(self.save_adjusted_image)
 
     def run(self):
         if self.first_start == True:
+            from .airgap_vis_dialog import AirGapVisDialog
+
             self.first_start = False
             self.dlg = AirGapVisDialog()
             self.dlg.contourToolButton.clicked.connect(self.select_contour_file)
             self.dlg.depthToolButton.clicked.connect(self.select_depth_file)
             self.dlg.westEastBackgroundToolButton.clicked.connect(self.select_west_east_background_file)
             self.dlg.eastWestBackgroundToolButton.clicked.connect(self.select_east_west_background_file)
-            self.dlg.generateButton.clicked.connect(self.generate)
+            self.dlg.generateButton.clicked.connect(lambda: self.generate())
+            self.dlg.previewButton.clicked.connect(self.preview)
 
             self.dlg.createDepthFileCheckBox.stateChanged.connect(self.create_depth_file_changed)
             self.dlg.bathymetryComboBox.currentIndexChanged.connect(self.bathymetry_changed)
 
-            self.sim_vis = SimVisDialog(parent=self.dlg)
-            self.sim_vis.westEastGroupBox.direction = Direction.WEST_TO_EAST
-            self.sim_vis.eastWestGroupBox.direction = Direction.EAST_TO_WEST
-
-            self.imageLabels[Direction.EAST_TO_WEST.value] = self.sim_vis.eastWestImageLabel
-            self.imageLabels[Direction.WEST_TO_EAST.value] = self.sim_vis.westEastImageLabel
-
-            self.sim_vis.vesselHeightSpinBox.valueChanged.connect(self.visualization_option_changed)
-            self.sim_vis.clearButton.clicked.connect(self.reset_vessel_height)
-
-            self.sim_vis.bathymetryCheckBox.stateChanged.connect(self.visualization_option_changed)
-            self.sim_vis.waterCheckBox.stateChanged.connect(self.visualization_option_changed)
-            
-            self.sim_vis.westEastBrightnessSlider.valueChanged.connect(self.brightness_changed)
-            self.sim_vis.eastWestBrightnessSlider.valueChanged.connect(self.brightness_changed)
-            
-            self.sim_vis.westEastSaturationSlider.valueChanged.connect(self.saturation_changed)
-            self.sim_vis.eastWestSaturationSlider.valueChanged.connect(self.saturation_changed)
-            
-            self.sim_vis.westEastSharpnessSlider.valueChanged.connect(self.sharpness_changed)
-            self.sim_vis.eastWestSharpnessSlider.valueChanged.connect(self.sharpness_changed)
-
-            self.sim_vis.westEastSaveButton.clicked.connect(self.save_adjusted_image)
-            self.sim_vis.eastWestSaveButton.clicked.connect(self.save_adjusted_image)
+            #the statistic and engine are read back from the item data, so the items can be in any order
+            self.dlg.contourStatisticComboBox.addItem("Minimum", ContourStatistic.MINIMUM.value)
+            self.dlg.contourStatisticComboBox.addItem("Percentile", ContourStatistic.PERCENTILE.value)
+            self.dlg.contourStatisticComboBox.addItem("Kth Lowest", ContourStatistic.KTH_LOWEST.value)
+
+            self.dlg.engineComboBox.addItem("Reference", Engine.REFERENCE.value)
+            self.dlg.engineComboBox.addItem("NumPy", Engine.NUMPY.value)
+
+            self.create_simulated_visualization(parent=self.dlg)
 
             self.dlg.showSimulatedVisualizationsButton.clicked.connect(self.sim_vis.show)
 
@@ -0,0 +1,188 @@
+from urllib.request import urlopen
+
+import argparse
+import csv
+import json
+import numpy
+import sys
+
+from .clearance import ClearanceIndex
+
+#Finds when vessels of given heights can pass under a bridge from a generated contour and a series
+#of air gap or water level readings. Every reading and vessel height is answered at once with the
+#clearance index, so a year of 6 minute readings takes well under a second. It only
+#needs numpy, so it runs without QGIS.
+#
+#Run with python -m airgap_vis.analytics --contour contour.json --csv levels.csv --base-height 45 --vessel-heights 40 42
+
+FEET_TO_METERS = 0.3048
+
+def load_contour(path):
+    #returns the contour heights and the meters per column
+    with open(path) as f:
+        contour_geojson = json.load(f)
+
+    feature = contour_geojson["features"][0]
+    heights = numpy.asarray([coordinate[2] for coordinate in feature["geometry"]["coordinates"][0]], dtype=float)
+
+    #simplified contours keep the column of each vertex and are filled in the same way as airgap.js
+    steps = feature["properties"].get("steps")
+    if steps:
+        heights = numpy.interp(numpy.arange(steps[-1] + 1), steps, heights)
+
+    return heights, feature["properties"]["length"] / len(heights)
+
+def load_csv(path, time_column="t", value_column="v"):
+    times = []
+    values = []
+
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            if row[value_column].strip() == "":
+                continue
+
+            times.append(row[time_column].strip().replace(" ", "T"))
+            values.append(float(row[value_column]))
+
+    return numpy.asarray(times, dtype="datetime64[s]"), numpy.asarray(values)
+
+def load_feed(location):
+    #the tidesandcurrents.noaa.gov JSON format, from a file or a URL such as a local stand-in
+    if "://" in location:
+        with urlopen(location) as response:
+            feed = json.load(response)
+    else:
+        with open(location) as f:
+            feed = json.load(f)
+
+    data = [reading for reading in feed["data"] if reading["v"] != ""]
+
+    times = numpy.asarray([reading["t"].replace(" ", "T") for reading in data], dtype="datetime64[s]")
+    values = numpy.asarray([float(reading["v"]) for reading in data])
+
+    return times, values
+
+def gap_changes(values, kind="air_gap", base_height=0, water_level_adjustment=0):
+    #how far the water is above the contour's zero, the same as gapChange in airgap.js
+    if kind == "air_gap":
+        return base_height - values
+
+    return water_level_adjustment + values
+
+def clearance_windows(heights, scale, times, gap_change, vessel_heights, minimum_width=0, maximum_interval=None):
+    #A vessel passes a column when the contour is higher than the vessel height plus the gap change,
+    #so the clearance index answers every reading and vessel height with one lookup. Openings only
+    #shrink as the water rises, so the opening at a window's highest water is open for all of it.
+    heights = numpy.asarray(heights, dtype=float)
+
+    #the contour writes 0 for blocked columns, which must stay blocked however far the water falls
+    index = ClearanceIndex(numpy.where(heights == 0, -numpy.inf, heights))
+
+    order = numpy.argsort(times, kind="stable")
+    times = times[order]
+    gap_change = numpy.asarray(gap_change, dtype=float)[order]
+    vessel_heights = numpy.asarray(vessel_heights, dtype=float)
+
+    thresholds = vessel_heights[None,:] + gap_change[:,None]
+
+    levels = numpy.maximum(numpy.searchsorted(index.thresholds, thresholds, side="right") - 1, 0)
+    widths = index.widest_widths[levels]
+    starts = index.widest_starts[levels]
+
+    passable = widths * scale > max(minimum_width, 0)
+    passable &= widths > 0
+
+    #readings further apart than maximum_interval, missing data for example, end a window
+    intervals = numpy.diff(times).astype("timedelta64[s]").astype(float)
+
+    if maximum_interval == None:
+        maximum_interval = 1.5 * numpy.median(intervals) if len(intervals) else 0
+
+    breaks = numpy.concatenate([[True], intervals > maximum_interval])
+
+    windows = []
+
+    for v, vessel_height in enumerate(vessel_heights):
+        open_readings = passable[:,v]
+
+        window_starts = numpy.flatnonzero(open_readings & (breaks | ~numpy.concatenate([[False], open_readings[:-1]])))
+        window_ends = numpy.flatnonzero(open_readings & numpy.concatenate([breaks[1:] | ~open_readings[1:], [True]]))
+
+        for start, end in zip(window_starts, window_ends):
+            worst = start + int(numpy.argmax(gap_change[start:end+1]))
+            width = int(widths[worst, v])
+            span_start = int(starts[worst, v])
+
+            windows.append({
+                "vessel_height": float(vessel_height),
+                "start": str(times[start]),
+                "end": str(times[end]),
+                "hours": float((times[end] - times[start]).astype("timedelta64[s]").astype(float) / 3600),
+                "span_start": span_start * scale,
+                "span_end": (span_start + width) * scale,
+                "width": width * scale,
+                "minimum_clearance": float(heights[span_start:span_start+width].min() - gap_change[worst])
+            })
+
+    return windows, {
+        "times": times,
+        "passable": passable,
+        "widest_widths": widths * scale,
+        "passable_widths": (len(heights) - numpy.searchsorted(index.sorted_heights, thresholds, side="right")) * scale
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Find when vessels can pass under a bridge from a contour and a water level series")
+    parser.add_argument("--contour", required=True, help="Contour GeoJSON file")
+
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="CSV file of readings")
+    source.add_argument("--feed", help="tidesandcurrents.noaa.gov style JSON file or URL")
+
+    parser.add_argument("--time-column", default="t")
+    parser.add_argument("--value-column", default="v")
+    parser.add_argument("--kind", default="air_gap", choices=["air_gap", "water_level"],
+        help="Whether the readings are air gaps, as from a station, or water levels, as from a gage")
+    parser.add_argument("--feet", action="store_true", help="The readings are in feet")
+    parser.add_argument("--base-height", type=float, default=0, help="Same as the visualization option")
+    parser.add_argument("--water-level-adjustment", type=float, default=0, help="Same as the visualization option")
+    parser.add_argument("--vessel-heights", type=float, nargs="+", required=True)
+    parser.add_argument("--minimum-width", type=float, default=0, help="Meters of opening a vessel needs")
+    parser.add_argument("--start", help="Only use readings from this time")
+    parser.add_argument("--end", help="Only use readings before this time")
+    parser.add_argument("--output", help="CSV file for the windows, defaults to standard output")
+    arguments = parser.parse_args()
+
+    heights, scale = load_contour(arguments.contour)
+
+    if arguments.csv:
+        times, values = load_csv(arguments.csv, arguments.time_column, arguments.value_column)
+    else:
+        times, values = load_feed(arguments.feed)
+
+    if arguments.feet:
+        values = values * FEET_TO_METERS
+
+    selected = numpy.ones(len(times), dtype=bool)
+    if arguments.start:
+        selected &= times >= numpy.datetime64(arguments.start.replace(" ", "T"))
+    if arguments.end:
+        selected &= times < numpy.datetime64(arguments.end.replace(" ", "T"))
+
+    gap_change = gap_changes(values[selected], arguments.kind, arguments.base_height, arguments.water_level_adjustment)
+
+    windows, _ = clearance_windows(heights, scale, times[selected], gap_change, arguments.vessel_heights,
+        minimum_width=arguments.minimum_width)
+
+    f = open(arguments.output, "w", newline="") if arguments.output else sys.stdout
+
+    try:
+        writer = csv.DictWriter(f, fieldnames=["vessel_height", "start", "end", "hours", "span_start", "span_end", "width", "minimum_clearance"])
+        writer.writeheader()
+        writer.writerows(windows)
+    finally:
+        if arguments.output:
+            f.close()
+
+if __name__ == "__main__":
+    main()
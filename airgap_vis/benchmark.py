@@ -0,0 +1,227 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtWidgets import QApplication, QCheckBox
+
+import argparse
+import json
+import numpy
+import os
+import sys
+import time
+
+from .airgap import Direction
+from .clearance import ClearanceIndex
+
+#Measures how long the simulated visualization takes to redraw after each control change. Generated
+#files are loaded into the plugin's own dialog at one or more widths, a script of control changes is
+#replayed and the latency of each change, including the repaint, is reported as percentiles.
+#
+#Run with python -m airgap_vis.benchmark --contour contour.json --east-west east_west.png --west-east west_east.png
+
+ADJUSTMENTS = ["brightness", "saturation", "sharpness"]
+CHECKBOXES = ["bathymetry", "water"]
+
+class LoadedPointCloud():
+    #the parts of AirGapPoints that the simulated visualization reads
+    def __init__(self, contour, depths):
+        self.contour = contour
+        self.depths = depths
+        self.clearance = ClearanceIndex([coordinate[2] for coordinate in contour])
+
+def resample(values, length):
+    indices = (numpy.arange(length) * len(values) / length).astype(int)
+    return [values[i] for i in indices]
+
+def load_artifacts(plugin, contour_path, depth_path, image_paths, width, padding_left=0, padding_right=0, padding_bottom=0,
+        direction=Direction.WEST_TO_EAST):
+    #the files are resampled to width so one set of files can be measured at several widths. The
+    #paddings are in pixels at the generated width.
+    from PIL import Image, ImageQt
+
+    with open(contour_path) as f:
+        contour_geojson = json.load(f)
+
+    contour = contour_geojson["features"][0]["geometry"]["coordinates"][0]
+    length = contour_geojson["features"][0]["properties"]["length"]
+
+    ratio = width / len(contour)
+
+    padding_left = int(padding_left * ratio)
+    padding_right = int(padding_right * ratio)
+    padding_bottom = int(padding_bottom * ratio)
+
+    depths = []
+    if depth_path:
+        with open(depth_path) as f:
+            depths = resample(json.load(f), width + padding_left + padding_right)
+
+    scale = length / width
+
+    for image_direction in Direction:
+        image = Image.open(image_paths[image_direction.value]).convert("RGBA")
+        image = image.resize((max(round(image.width * ratio), 1), max(round(image.height * ratio), 1)), Image.NEAREST)
+
+        plugin.images[image_direction.value]["original"] = ImageQt.ImageQt(image)
+        plugin.images[image_direction.value]["enhanced"] = ImageQt.ImageQt(image)
+
+    plugin.point_cloud = LoadedPointCloud(resample(contour, width), depths)
+    plugin.scale = scale
+    plugin.width = width
+    plugin.padding_left = padding_left
+    plugin.padding_right = padding_right
+    plugin.padding_bottom = padding_bottom
+    plugin.adjusted_padding_bottom = padding_bottom + int(-min(depths, default=0) / scale)
+    plugin.direction = direction
+
+def default_script(maximum_height, rounds=3):
+    #every event changes its control, since setting a control to its current value does not redraw
+    events = []
+
+    #a flat contour would otherwise sweep the vessel height over a single value
+    maximum_height = max(maximum_height, 10)
+
+    for _ in range(rounds):
+        for direction in Direction:
+            for adjustment in ADJUSTMENTS:
+                for value in [5, 15, 10]:
+                    events.append({"control": adjustment, "direction": direction.value, "value": value})
+
+        for vessel_height in numpy.linspace(0.1, 1.1, 10) * maximum_height:
+            events.append({"control": "vessel_height", "value": max(int(vessel_height), 1)})
+
+        for checkbox in CHECKBOXES:
+            events.append({"control": checkbox, "value": False})
+            events.append({"control": checkbox, "value": True})
+
+        events.append({"control": "vessel_height", "value": 0})
+
+    return events
+
+def control_widget(sim_vis, event):
+    control = event["control"]
+
+    if control in ADJUSTMENTS:
+        prefix = "westEast" if event["direction"] == Direction.WEST_TO_EAST.value else "eastWest"
+        return getattr(sim_vis, f"{prefix}{control.capitalize()}Slider")
+
+    return {
+        "vessel_height": sim_vis.vesselHeightSpinBox,
+        "bathymetry": sim_vis.bathymetryCheckBox,
+        "water": sim_vis.waterCheckBox
+    }[control]
+
+def replay(plugin, events, warmup=0):
+    #returns the latencies in seconds of each control. Events that would not change their control
+    #are skipped rather than timed as no-ops.
+    latencies = {}
+
+    for i, event in enumerate(events):
+        widget = control_widget(plugin.sim_vis, event)
+
+        if isinstance(widget, QCheckBox):
+            value = bool(event["value"])
+            if widget.isChecked() == value:
+                continue
+            change = lambda: widget.setChecked(value)
+        else:
+            value = min(max(int(event["value"]), widget.minimum()), widget.maximum())
+            if widget.value() == value:
+                continue
+            change = lambda: widget.setValue(value)
+
+        #the handlers run inside the change and the labels repaint while processing events
+        start = time.perf_counter()
+        change()
+        QCoreApplication.processEvents()
+        elapsed = time.perf_counter() - start
+
+        if i >= warmup:
+            latencies.setdefault(event["control"], []).append(elapsed)
+
+    return latencies
+
+def summarize(latencies):
+    summary = {}
+
+    for control, values in latencies.items():
+        milliseconds = numpy.asarray(values) * 1000
+
+        summary[control] = {
+            "count": len(values),
+            "p50": float(numpy.percentile(milliseconds, 50)),
+            "p90": float(numpy.percentile(milliseconds, 90)),
+            "p99": float(numpy.percentile(milliseconds, 99)),
+            "max": float(milliseconds.max())
+        }
+
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure simulated visualization redraw latency")
+    parser.add_argument("--contour", required=True, help="Contour GeoJSON file")
+    parser.add_argument("--depth", help="Depth JSON file")
+    parser.add_argument("--east-west", required=True, help="East to West background image")
+    parser.add_argument("--west-east", required=True, help="West to East background image")
+    parser.add_argument("--widths", type=int, nargs="+", help="Widths to measure at, defaults to the generated width")
+    parser.add_argument("--padding-left", type=int, default=0)
+    parser.add_argument("--padding-right", type=int, default=0)
+    parser.add_argument("--padding-bottom", type=int, default=0)
+    parser.add_argument("--direction", default=Direction.WEST_TO_EAST.value, choices=[direction.value for direction in Direction],
+        help="The direction the contour was generated in")
+    parser.add_argument("--script", help="JSON file with a list of events, defaults to sweeps of every control")
+    parser.add_argument("--rounds", type=int, default=3, help="Repetitions of the default script")
+    parser.add_argument("--warmup", type=int, default=5, help="Events at the start of each width that are not timed")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    arguments = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    application = QApplication(sys.argv)
+
+    #imported after the application exists since it loads the plugin resources
+    from .airgap_vis import AirGapVis
+
+    image_paths = {
+        Direction.EAST_TO_WEST.value: arguments.east_west,
+        Direction.WEST_TO_EAST.value: arguments.west_east
+    }
+
+    results = {}
+
+    with open(arguments.contour) as f:
+        generated_width = len(json.load(f)["features"][0]["geometry"]["coordinates"][0])
+
+    for width in arguments.widths or [generated_width]:
+        plugin = AirGapVis(None)
+        plugin.create_simulated_visualization()
+
+        load_artifacts(plugin, arguments.contour, arguments.depth, image_paths, width, padding_left=arguments.padding_left,
+            padding_right=arguments.padding_right, padding_bottom=arguments.padding_bottom, direction=Direction(arguments.direction))
+
+        for direction in Direction:
+            plugin.update_simulated_visualization(direction)
+
+        plugin.sim_vis.show()
+        QCoreApplication.processEvents()
+
+        if arguments.script:
+            with open(arguments.script) as f:
+                events = json.load(f)
+        else:
+            events = default_script(plugin.point_cloud.clearance.sorted_heights[-1], rounds=arguments.rounds)
+
+        results[width] = summarize(replay(plugin, events, warmup=arguments.warmup))
+
+        plugin.sim_vis.close()
+
+    print(f"{'width':>6} {'control':<14} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+
+    for width, summary in results.items():
+        for control, statistics in summary.items():
+            print(f"{width:>6} {control:<14} {statistics['count']:>6} {statistics['p50']:>9.2f} {statistics['p90']:>9.2f} "
+                f"{statistics['p99']:>9.2f} {statistics['max']:>9.2f}")
+
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
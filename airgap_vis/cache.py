@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+import os
+import threading
+
+#Keeps decoded point clouds between Generate clicks. Entries are keyed by path and modification
+#time so a file that changes on disk is read again, and the least recently used entries are
+#dropped once the total size goes over maximum_bytes.
+
+class PointCloudCache():
+    def __init__(self, maximum_bytes):
+        self.maximum_bytes = maximum_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path):
+        return (path, os.path.getmtime(path))
+
+    def get(self, path):
+        with self.lock:
+            key = self.key(path)
+
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, path, points, size):
+        with self.lock:
+            key = self.key(path)
+
+            self.remove(lambda entry_key: entry_key[0] == path)
+
+            if size > self.maximum_bytes:
+                return
+
+            self.entries[key] = (points, size)
+            self.total_bytes += size
+
+            while self.total_bytes > self.maximum_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def invalidate(self, path):
+        with self.lock:
+            self.remove(lambda entry_key: entry_key[0] == path)
+
+    def clear(self):
+        with self.lock:
+            self.remove(lambda entry_key: True)
+
+    def remove(self, condition):
+        for key in [key for key in self.entries if condition(key)]:
+            self.total_bytes -= self.entries.pop(key)[1]
+
+    def statistics(self):
+        return f"{self.hits} hits, {self.misses} misses, {len(self.entries)} cached using {self.total_bytes / 1024**2:.0f} MiB"
@@ -0,0 +1,171 @@
+import numpy
+
+#analytics uses this outside of QGIS, so it only needs numpy.
+
+class ClearanceIndex():
+    def __init__(self, heights):
+        self.heights = numpy.asarray(heights, dtype=float)
+        self.sorted_heights = numpy.sort(self.heights)
+
+        self.build()
+
+    def build(self):
+        #A column is passable for a vessel of height H when its clearance is greater than H. Sweeping
+        #the distinct clearances from highest to lowest opens columns in that order, and every run of
+        #open columns that forms along the way is a maximal span for a range of vessel heights.
+        heights = self.heights
+        length = len(heights)
+
+        levels = numpy.unique(heights)[::-1]
+        order = numpy.argsort(-heights, kind="stable")
+        level_starts = numpy.searchsorted(-heights[order], -levels, side="left")
+
+        is_open = numpy.zeros(length + 2, dtype=bool)
+        run_end = numpy.zeros(length + 2, dtype=numpy.int64)
+        run_start = numpy.zeros(length + 2, dtype=numpy.int64)
+        run_birth = numpy.zeros(length + 2)
+
+        spans = []
+
+        widest = 0
+        widest_start = -1
+
+        #thresholds are ascending and the first entry is for vessels lower than every column
+        thresholds = [levels[0]] if length else [-numpy.inf]
+        widest_widths = [0]
+        widest_starts = [-1]
+
+        for k, level in enumerate(levels):
+            end = level_starts[k+1] if k + 1 < len(levels) else length
+
+            #positions are shifted by one so the neighbours of the first and last columns exist
+            for column in order[level_starts[k]:end] + 1:
+                start = column
+                stop = column
+
+                if is_open[column-1]:
+                    start = run_start[column-1]
+                    if run_birth[start] > level:
+                        spans.append((start - 1, column - 2, level, run_birth[start]))
+
+                if is_open[column+1]:
+                    stop = run_end[column+1]
+                    if run_birth[column+1] > level:
+                        spans.append((column, stop - 1, level, run_birth[column+1]))
+
+                is_open[column] = True
+                run_end[start] = stop
+                run_start[stop] = start
+                run_birth[start] = level
+
+                if stop - start + 1 > widest:
+                    widest = stop - start + 1
+                    widest_start = start - 1
+
+            if k + 1 < len(levels):
+                thresholds.append(levels[k+1])
+            else:
+                thresholds.append(-numpy.inf)
+            widest_widths.append(widest)
+            widest_starts.append(widest_start)
+
+        column = 1
+        while column <= length:
+            if is_open[column]:
+                spans.append((column - 1, run_end[column] - 1, -numpy.inf, run_birth[column]))
+                column = run_end[column] + 1
+            else:
+                column += 1
+
+        #stored lowest threshold first so lookups can use searchsorted
+        self.thresholds = numpy.asarray(thresholds[::-1])
+        self.widest_widths = numpy.asarray(widest_widths[::-1], dtype=numpy.int64)
+        self.widest_starts = numpy.asarray(widest_starts[::-1], dtype=numpy.int64)
+
+        spans = numpy.asarray(spans, dtype=float).reshape(-1, 4)
+        spans = spans[numpy.argsort(spans[:,0], kind="stable")]
+
+        self.span_starts = spans[:,0].astype(numpy.int64)
+        self.span_ends = spans[:,1].astype(numpy.int64)
+        self.span_lows = spans[:,2]
+        self.span_highs = spans[:,3]
+
+    def level(self, vessel_height):
+        return max(numpy.searchsorted(self.thresholds, vessel_height, side="right") - 1, 0)
+
+    def passable_width(self, vessel_height):
+        return len(self.heights) - numpy.searchsorted(self.sorted_heights, vessel_height, side="right")
+
+    def widest_opening(self, vessel_height, reverse=False):
+        k = self.level(vessel_height)
+        width = int(self.widest_widths[k])
+
+        if width == 0:
+            return None
+
+        start = int(self.widest_starts[k])
+        if reverse:
+            start = len(self.heights) - start - width
+
+        return start, start + width - 1
+
+    def spans(self, vessel_height, reverse=False):
+        current = (self.span_lows <= vessel_height) & (vessel_height < self.span_highs)
+        spans = list(zip(self.span_starts[current].tolist(), self.span_ends[current].tolist()))
+
+        if reverse:
+            last = len(self.heights) - 1
+            spans = [(last - end, last - start) for start, end in reversed(spans)]
+
+        return spans
+
+    def to_json(self):
+        return {
+            "thresholds": [float(t) if numpy.isfinite(t) else None for t in self.thresholds],
+            "widest_widths": self.widest_widths.tolist(),
+            "widest_starts": self.widest_starts.tolist(),
+            "sorted_heights": self.sorted_heights.tolist(),
+            "spans": [
+                [int(start), int(end), float(low) if numpy.isfinite(low) else None, float(high)]
+                for start, end, low, high in zip(self.span_starts, self.span_ends, self.span_lows, self.span_highs)
+            ]
+        }
+
+def simplify_heights(heights, tolerance):
+    #Douglas-Peucker with a one sided error. The straight lines between the kept columns may sit up to
+    #tolerance below the heights but never above them, so the clearance of a span can only be
+    #underestimated. Returns the kept column indices, always including the first and last.
+    heights = numpy.asarray(heights, dtype=float)
+    length = len(heights)
+
+    if length < 3:
+        return numpy.arange(length)
+
+    keep = numpy.zeros(length, dtype=bool)
+    keep[[0, length - 1]] = True
+
+    segments = [(0, length - 1)]
+
+    while segments:
+        start, end = segments.pop()
+
+        if end - start < 2:
+            continue
+
+        #same operation order as the interpolation in airgap.js so both sides round the same way
+        steps = numpy.arange(start + 1, end)
+        line = heights[start] + (heights[end] - heights[start]) * (steps - start) / (end - start)
+        above = line - heights[start+1:end]
+
+        if above.max() > 0:
+            split = start + 1 + int(numpy.argmax(above))
+        elif -above.min() > tolerance:
+            split = start + 1 + int(numpy.argmin(above))
+        else:
+            continue
+
+        keep[split] = True
+        segments.append((start, split))
+        segments.append((split, end))
+
+    return numpy.flatnonzero(keep)
@@ -0,0 +1,126 @@
+import numpy
+
+#Vectorized versions of the loops in AirGapPoints, used when the engine setting is numpy. Each one
+#gives the same result as the loop it replaces, including the loops' float32 depth test and their
+#handling of edge columns, and airgap_vis.parity checks that on real point clouds.
+
+def find_color(color_grid, closest_y, xyz, r, g, b, black_and_white=False, nearest_maximum=False):
+    x = xyz[:,0].astype(numpy.int64)
+    y = xyz[:,2].astype(numpy.int64)
+
+    if black_and_white:
+        color_grid[y,x] = False
+        return color_grid
+
+    if len(xyz) == 0:
+        return color_grid
+
+    depth = -xyz[:,1] if nearest_maximum else xyz[:,1]
+
+    #closest_y is float32, so the loop compares each point against the rounded depth of the last
+    #winner. The winner ends up in the group with the lowest rounded depth. It is the last point of
+    #that group below the rounded depth, or the group's first point when none are below it.
+    rounded = depth.astype(numpy.float32)
+    cells = y * color_grid.shape[1] + x
+
+    order = numpy.lexsort((rounded, cells))
+    sorted_cells = cells[order]
+
+    starts = numpy.ones(len(order), dtype=bool)
+    starts[1:] = sorted_cells[1:] != sorted_cells[:-1]
+    groups = numpy.cumsum(starts) - 1
+
+    lowest = rounded[order][starts]
+    winners = order[starts]
+
+    below = (rounded[order] == lowest[groups]) & (depth[order] < lowest[groups])
+    last_below = numpy.full(len(winners), -1)
+    numpy.maximum.at(last_below, groups[below], order[below])
+
+    winners = numpy.where(last_below >= 0, last_below, winners)
+
+    closest_y[y[winners],x[winners]] = xyz[winners,1]
+
+    color_grid[y[winners],x[winners],0] = r[winners]
+    color_grid[y[winners],x[winners],1] = g[winners]
+    color_grid[y[winners],x[winners],2] = b[winners]
+    color_grid[y[winners],x[winners],3] = 255
+
+    return color_grid
+
+def refine_ends(x, z, west, east, refinement_condition, granularity=0.1):
+    #steps the ends the same way as the loop, but each step reads a slice of the points sorted by x
+    #rather than testing every point
+    order = numpy.argsort(x, kind="stable")
+    sorted_x = x[order]
+    sorted_z = z[order]
+
+    def lowest(lower, upper):
+        return numpy.min(sorted_z[numpy.searchsorted(sorted_x, lower):numpy.searchsorted(sorted_x, upper)])
+
+    while not refinement_condition(lowest(west, west + granularity)):
+        west += granularity
+
+    while not refinement_condition(lowest(east, east + granularity)):
+        east -= granularity
+
+    return west, east
+
+def contour_heights(bin_heights, minimum_height):
+    #empty bins carry the height before them and heights below minimum_height are 0, as in the loop
+    finite = numpy.isfinite(bin_heights)
+    carried = numpy.maximum.accumulate(numpy.where(finite, numpy.arange(len(bin_heights)), 0))
+
+    heights = numpy.where(finite[carried], bin_heights[carried], 0)
+    heights[heights < minimum_height] = 0
+
+    return heights
+
+def average_and_color(extract_ranges, color, draw_lower=True, alpha=255):
+    group_for_color = color[
+        extract_ranges[0][0]:extract_ranges[0][1],
+        extract_ranges[1][0]:extract_ranges[1][1]
+    ]
+
+    opaque = group_for_color[group_for_color[...,3] == 255]
+    average = [opaque[:,channel].mean() if len(opaque) > 0 else 0 for channel in range(3)]
+
+    if draw_lower:
+        color[
+            0:extract_ranges[0][0],
+            extract_ranges[1][0]:extract_ranges[1][1]
+        ] = average + [alpha]
+
+    yl = group_for_color.shape[0]
+
+    if yl == 0:
+        return
+
+    #each column is filled up to its first visible pixel, unless that is the top row or there is none
+    visible = group_for_color[...,3] != 0
+    first = numpy.where(visible.any(axis=0), visible.argmax(axis=0), yl - 1)
+
+    fill = (numpy.arange(yl)[:,None] < first) & (first != yl - 1)
+    group_for_color[fill] = average + [alpha]
+
+def color_obstructions(colors, padding_left, padding_bottom, padding_right, color_height):
+    #a column is occupied when its mean is above 0, so the runs of occupied columns are found at
+    #once. Averaging a run only changes the columns in it, so the later columns are unaffected.
+    xl = colors.shape[1]
+
+    band = colors[padding_bottom:padding_bottom+color_height, padding_right:xl - padding_left]
+
+    if band.shape[0] == 0 or band.shape[1] == 0:
+        return
+
+    occupied = numpy.concatenate([[False], band.any(axis=(0, 2)), [False]])
+    edges = numpy.flatnonzero(occupied[1:] != occupied[:-1]) + padding_right
+
+    for start_i, end_i in zip(edges[::2], edges[1::2]):
+        #the loop leaves out the last column of a run that reaches the edge, and skips that run
+        #entirely when it starts at column 0
+        if end_i == xl - padding_left:
+            if start_i:
+                average_and_color([[padding_bottom, padding_bottom+color_height], [start_i, end_i - 1]], colors)
+        else:
+            average_and_color([[padding_bottom, padding_bottom+color_height], [start_i, end_i]], colors)
@@ -0,0 +1,19 @@
+from enum import Enum
+
+#The generation option values, kept apart from airgap so the plugin can use them at QGIS startup
+#without loading numpy and the generation code.
+
+class Direction(Enum):
+    EAST_TO_WEST = "east_west"
+    WEST_TO_EAST = "west_east"
+
+class ContourStatistic(Enum):
+    MINIMUM = "minimum"
+    PERCENTILE = "percentile"
+    KTH_LOWEST = "kth_lowest"
+
+class Engine(Enum):
+    #reference runs the original loops and numpy the vectorized versions in kernels, which
+    #airgap_vis.parity compares
+    REFERENCE = "reference"
+    NUMPY = "numpy"
@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import multiprocessing
+import numpy
+import os
+import sys
+
+#This module is imported by the worker processes, so it must not import qgis or anything
+#else that is only available inside QGIS.
+
+def pool_context():
+    #fork is not safe from inside a Qt application, and inside QGIS sys.executable is usually
+    #the QGIS binary rather than python, so spawn needs to be pointed at the real interpreter
+    context = multiprocessing.get_context("spawn")
+
+    if not os.path.basename(sys.executable).lower().startswith("python"):
+        if sys.platform == "win32":
+            executable = os.path.join(sys.exec_prefix, "python.exe")
+        else:
+            executable = os.path.join(sys.exec_prefix, "bin", "python3")
+
+        if os.path.exists(executable):
+            context.set_executable(executable)
+
+    return context
+
+def share_array(array):
+    array = numpy.ascontiguousarray(array)
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+
+    shared = numpy.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+    shared[:] = array
+
+    return memory, (memory.name, array.shape, array.dtype.str)
+
+def attach_array(description):
+    name, shape, dtype = description
+    memory = shared_memory.SharedMemory(name=name)
+
+    return memory, numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=memory.buf)
+
+def chunk_ranges(length, chunks):
+    bounds = numpy.linspace(0, length, chunks + 1).astype(int)
+    return [(bounds[i], bounds[i+1]) for i in range(chunks) if bounds[i] < bounds[i+1]]
+
+def nearest_points(cells, depth):
+    #returns the positions, in order, of the points that can still win the depth test in find_color.
+    #It compares each point against the float32 depth of the last winner, so the winner is one of
+    #the points whose depth rounds to the lowest float32 depth of the cell, and which one depends
+    #on the order. All of those are kept and everything behind them is dropped.
+    rounded = depth.astype(numpy.float32)
+    order = numpy.lexsort((rounded, cells))
+    sorted_cells = cells[order]
+    sorted_rounded = rounded[order]
+
+    starts = numpy.ones(len(order), dtype=bool)
+    starts[1:] = sorted_cells[1:] != sorted_cells[:-1]
+    groups = numpy.cumsum(starts) - 1
+
+    nearest = sorted_rounded == sorted_rounded[starts][groups]
+
+    return numpy.sort(order[nearest])
+
+def partial_nearest(xyz_description, start, end, x_width, nearest_maximum):
+    memory, xyz = attach_array(xyz_description)
+
+    try:
+        chunk = xyz[start:end]
+        cells = chunk[:,2].astype(numpy.int64) * x_width + chunk[:,0].astype(numpy.int64)
+        depth = -chunk[:,1] if nearest_maximum else chunk[:,1]
+
+        winners = nearest_points(cells, depth)
+
+        return cells[winners], depth[winners], winners + start
+    finally:
+        del chunk, xyz
+        memory.close()
+
+def partial_minima(xyz_description, start, end, steps):
+    memory, xyz = attach_array(xyz_description)
+
+    try:
+        chunk = xyz[start:end]
+        bins = chunk[:,0].astype(numpy.int64)
+        in_range = (bins >= 0) & (bins < steps)
+
+        minima = numpy.full(steps, numpy.inf)
+        numpy.minimum.at(minima, bins[in_range], chunk[in_range,2])
+
+        return minima
+    finally:
+        del chunk, xyz
+        memory.close()
+
+def partial_lowest(xyz_description, start, end, steps, kth_lowest):
+    memory, xyz = attach_array(xyz_description)
+
+    try:
+        chunk = xyz[start:end]
+        bins = chunk[:,0].astype(numpy.int64)
+        in_range = (bins >= 0) & (bins < steps)
+        bins = bins[in_range]
+
+        order = numpy.lexsort((chunk[in_range,2], bins))
+        heights = chunk[in_range,2][order]
+
+        #the kth_lowest lowest heights of each bin, padded with inf
+        counts = numpy.bincount(bins, minlength=steps)
+        offsets = numpy.arange(kth_lowest)
+        kept = offsets < counts[:,None]
+
+        lowest = numpy.full((steps, kth_lowest), numpy.inf)
+        lowest[kept] = heights[((numpy.cumsum(counts) - counts)[:,None] + offsets)[kept]]
+
+        return counts, lowest
+    finally:
+        del chunk, xyz
+        memory.close()
+
+def map_chunks(function, xyz, processes, *args):
+    memory, description = share_array(xyz)
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=pool_context()) as pool:
+            futures = [pool.submit(function, description, start, end, *args)
+                for start, end in chunk_ranges(len(xyz), processes)]
+            return [future.result() for future in futures]
+    finally:
+        memory.close()
+        memory.unlink()
+
+def parallel_nearest(xyz, x_width, nearest_maximum=False, processes=2):
+    partials = map_chunks(partial_nearest, xyz, processes, x_width, nearest_maximum)
+
+    cells = numpy.concatenate([p[0] for p in partials])
+    depth = numpy.concatenate([p[1] for p in partials])
+    indices = numpy.concatenate([p[2] for p in partials])
+
+    #partials are in chunk order, so the points kept by the final reduction stay in file order
+    return indices[nearest_points(cells, depth)]
+
+def parallel_minima(xyz, steps, processes=2):
+    partials = map_chunks(partial_minima, xyz, processes, steps)
+
+    return numpy.minimum.reduce(partials)
+
+def parallel_lowest(xyz, steps, kth_lowest=3, processes=2):
+    #the count, minimum and kth lowest height of each bin, the same as bin_statistics gives, since
+    #the kth lowest of a bin is among the kth_lowest lowest of every chunk
+    partials = map_chunks(partial_lowest, xyz, processes, steps, kth_lowest)
+
+    counts = numpy.sum([p[0] for p in partials], axis=0)
+    lowest = numpy.sort(numpy.concatenate([p[1] for p in partials], axis=1), axis=1)
+
+    occupied = counts > 0
+    kth = lowest[numpy.arange(steps), numpy.clip(numpy.minimum(kth_lowest, counts) - 1, 0, None)]
+
+    return {
+        "count": counts,
+        "minimum": numpy.where(occupied, lowest[:,0], numpy.nan),
+        "kth_lowest": numpy.where(occupied, kth, numpy.nan)
+    }
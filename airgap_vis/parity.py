@@ -0,0 +1,268 @@
+from qgis.core import QgsApplication, QgsRasterLayer
+
+import argparse
+import json
+import numpy
+import os
+import sys
+import tempfile
+import time
+
+from .airgap import *
+from .watch import generation_settings
+
+#Runs the reference loops and one or more fast paths, the numpy engine, decimation, worker
+#processes and extra widths, on the same point cloud and checks that they make the same files.
+#Contour heights, positions and depths are compared within tolerances, images pixel by pixel, and
+#each stage is timed so the speedup is reported next to any mismatches. Exits with 1 when a fast
+#path does not match, so it can gate switching one on.
+#
+#Run with python -m airgap_vis.parity --point-cloud bridge.laz --end-points 500100 3300200 500400 3300300
+
+#the settings that turn off every fast path
+REFERENCE_SETTINGS = {"engine": Engine.REFERENCE, "decimate": False, "processes": 1, "widths": ()}
+
+def variant_settings(name, settings, processes=2, widths=None):
+    #the settings of a fast path, which only differ from the reference in that path
+    width = settings.get("width", 1000)
+
+    return {
+        "numpy": {"engine": Engine.NUMPY},
+        "decimate": {"decimate": True},
+        "processes": {"processes": processes},
+        #a narrower width and a wider one that does not divide evenly into the main width
+        "widths": {"widths": widths or [width // 2, width * 3 // 2]}
+    }[name]
+
+VARIANTS = ["numpy", "decimate", "processes", "widths"]
+
+def run_job(points, end_points, output_dir, bathymetry_layer=None, repeat=1, **settings):
+    #returns the job from the last run and the fastest time of each stage over all the runs
+    timings = {}
+
+    for _ in range(repeat):
+        job = VisualizationJob(AirGapPoints(points, *end_points), os.path.join(output_dir, "contour.json"),
+            depth_path=os.path.join(output_dir, "depth.json"), bathymetry_layer=bathymetry_layer, **settings)
+
+        #the frame stage rotates the points and refines the ends
+        stages = [("frame", lambda: job.point_cloud.prepare_frame(job.minimum_height, job.refine_ends)), ("contour", job.contour)]
+
+        if bathymetry_layer:
+            stages.append(("depth", job.depth))
+
+        for direction in job.directions:
+            stages.append((direction.value, lambda direction=direction: job.image(direction)))
+
+        for name, stage in stages:
+            start = time.perf_counter()
+            stage()
+            elapsed = time.perf_counter() - start
+
+            timings[name] = min(timings.get(name, elapsed), elapsed)
+
+    return job, timings
+
+def compare_values(reference, other, tolerance):
+    reference = numpy.asarray(reference, dtype=float)
+    other = numpy.asarray(other, dtype=float)
+
+    if reference.shape != other.shape:
+        return {"match": False, "shape": [list(reference.shape), list(other.shape)]}
+
+    difference = numpy.abs(reference - other)
+
+    return {
+        "match": bool((difference <= tolerance).all()),
+        "mismatches": int(numpy.count_nonzero(difference > tolerance)),
+        "maximum_difference": float(difference.max(initial=0))
+    }
+
+def compare_contours(reference_path, other_path, tolerance, position_tolerance):
+    #heights are compared in meters and positions in degrees, each against its own tolerance
+    contours = []
+
+    for path in [reference_path, other_path]:
+        with open(path) as f:
+            feature = json.load(f)["features"][0]
+
+        contours.append((numpy.asarray(feature["geometry"]["coordinates"][0], dtype=float), feature["properties"]))
+
+    (reference, reference_properties), (other, other_properties) = contours
+
+    if reference.shape != other.shape:
+        return {"match": False, "shape": [list(reference.shape), list(other.shape)]}
+
+    comparison = compare_values(reference[:,2], other[:,2], tolerance)
+    positions = compare_values(reference[:,:2], other[:,:2], position_tolerance)
+
+    comparison["position_match"] = positions["match"]
+    comparison["position_maximum_difference"] = positions["maximum_difference"]
+    comparison["flagged_match"] = reference_properties["flagged"] == other_properties["flagged"]
+    comparison["match"] = comparison["match"] and comparison["position_match"] and comparison["flagged_match"]
+
+    return comparison
+
+def compare_images(reference, other, diff_path=None):
+    reference = numpy.asarray(reference)
+    other = numpy.asarray(other)
+
+    if reference.shape != other.shape:
+        return {"match": False, "shape": [list(reference.shape), list(other.shape)]}
+
+    difference = numpy.abs(reference.astype(numpy.int16) - other.astype(numpy.int16)).max(axis=-1)
+    mismatched = difference > 0
+
+    if diff_path and mismatched.any():
+        from PIL import Image
+
+        #the reference image faded, with the mismatched pixels in red
+        diff = (reference[...,:3] // 3).astype(numpy.uint8)
+        diff[mismatched] = [255, 0, 0]
+        Image.fromarray(diff).save(diff_path)
+
+    rows, columns = numpy.nonzero(mismatched)
+
+    return {
+        "match": not mismatched.any(),
+        "mismatches": int(mismatched.sum()),
+        "fraction": float(mismatched.mean()),
+        "maximum_difference": int(difference.max(initial=0)),
+        "bounds": [int(columns.min()), int(rows.min()), int(columns.max()), int(rows.max())] if len(rows) else None
+    }
+
+def compare_variants(points, end_points, variants, output_dir, bathymetry_layer=None, repeat=1, tolerance=0.001, position_tolerance=1e-8,
+        depth_tolerance=0.001, diff_dir=None, processes=2, widths=None, **settings):
+    settings = dict(settings, **REFERENCE_SETTINGS)
+
+    def run(name, **overrides):
+        run_dir = os.path.join(output_dir, name)
+        os.makedirs(run_dir, exist_ok=True)
+
+        return (run_dir, *run_job(points, end_points, run_dir, bathymetry_layer=bathymetry_layer, repeat=repeat, **dict(settings, **overrides)))
+
+    def compare_images_to(reference_job, job, name, images):
+        comparisons = {}
+
+        for direction in job.directions:
+            diff_path = os.path.join(diff_dir, f"{name}_{direction.value}.png") if diff_dir else None
+            comparisons[direction.value] = compare_images(reference_job.images[direction.value], images[direction.value], diff_path)
+
+        return comparisons
+
+    reference_dir, reference_job, reference_timings = run("reference")
+    results = {}
+
+    for name in variants:
+        run_dir, job, timings = run(name, **variant_settings(name, settings, processes, widths))
+
+        comparisons = {"contour": compare_contours(os.path.join(reference_dir, "contour.json"), os.path.join(run_dir, "contour.json"),
+            tolerance, position_tolerance)}
+
+        if bathymetry_layer:
+            comparisons["depth"] = compare_values(reference_job.point_cloud.depths, job.point_cloud.depths, depth_tolerance)
+
+        comparisons.update(compare_images_to(reference_job, job, name, job.images))
+
+        #the images of the other widths must match a reference run at that width, with the same
+        #scaled paddings. Their contours and depths are reduced from the finest width, and so is the
+        #depth scale of their images, so those are only compared without bathymetry.
+        for width, variant in ({} if bathymetry_layer else job.variants).items():
+            padding_left, padding_right, padding_bottom = job.paddings(width)
+            _, width_job, _ = run(f"reference_{width}", width=width, padding_left=padding_left, padding_right=padding_right,
+                padding_bottom=padding_bottom)
+
+            for direction, comparison in compare_images_to(width_job, job, f"{name}_{width}", variant["images"]).items():
+                comparisons[f"{direction}_{width}"] = comparison
+
+        results[name] = {
+            "match": all(comparison["match"] for comparison in comparisons.values()),
+            "comparisons": comparisons,
+            "timings": {stage: {"reference": reference_timings[stage], "variant": elapsed, "speedup": reference_timings[stage] / elapsed if elapsed else None}
+                for stage, elapsed in timings.items()}
+        }
+
+    return results
+
+def print_results(results):
+    for variant, result in results.items():
+        print(f"{variant}: {'match' if result['match'] else 'MISMATCH'}")
+        print(f"  {'stage':<10} {'reference s':>12} {'variant s':>10} {'speedup':>8}")
+
+        for stage, timing in result["timings"].items():
+            speedup = f"{timing['speedup']:.1f}x" if timing["speedup"] else "-"
+            print(f"  {stage:<10} {timing['reference']:>12.3f} {timing['variant']:>10.3f} {speedup:>8}")
+
+        for name, comparison in result["comparisons"].items():
+            if "shape" in comparison:
+                details = f"shape {comparison['shape'][0]} against {comparison['shape'][1]}"
+            elif "position_match" in comparison:
+                details = (f"{comparison['mismatches']} heights differ by up to {comparison['maximum_difference']:.6g}, "
+                    f"positions by up to {comparison['position_maximum_difference']:.3g}")
+            elif "fraction" in comparison:
+                details = f"{comparison['mismatches']} pixels ({comparison['fraction']:.4%}) differ by up to {comparison['maximum_difference']}"
+            else:
+                details = f"{comparison['mismatches']} values differ by up to {comparison['maximum_difference']:.6g}"
+
+            print(f"  {name:<14} {'match' if comparison['match'] else 'MISMATCH':<9} {details}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the fast paths make the same files as the reference loops")
+    parser.add_argument("--point-cloud", required=True, help="LAS or LAZ file")
+    parser.add_argument("--end-points", type=float, nargs=4, required=True, metavar=("WEST_X", "WEST_Y", "EAST_X", "EAST_Y"),
+        help="The two end points in the point cloud coordinates")
+    parser.add_argument("--bathymetry", help="Raster to sample depths from")
+    parser.add_argument("--settings", help="JSON file with generation settings, using the same keys as the watch folder settings")
+    parser.add_argument("--variants", nargs="+", default=VARIANTS, choices=VARIANTS, help="Fast paths to compare with the reference loops")
+    parser.add_argument("--processes", type=int, default=2, help="Worker processes for the processes variant")
+    parser.add_argument("--widths", type=int, nargs="+", help="Other widths for the widths variant, half and one and a half times the width by default")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of each variant, the fastest time of each stage is reported")
+    parser.add_argument("--tolerance", type=float, default=0.001, help="Largest allowed contour height difference in meters")
+    parser.add_argument("--position-tolerance", type=float, default=1e-8, help="Largest allowed contour position difference in degrees")
+    parser.add_argument("--depth-tolerance", type=float, default=0.001, help="Largest allowed depth difference in meters")
+    parser.add_argument("--diff-dir", help="Folder for images marking mismatched pixels")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    arguments = parser.parse_args()
+
+    settings = {}
+    if arguments.settings:
+        with open(arguments.settings) as f:
+            settings = json.load(f)
+
+    point_filter = settings.get("point_filter", DEFAULT_POINT_FILTER)
+    settings = generation_settings(settings)
+    for name in REFERENCE_SETTINGS:
+        settings.pop(name, None)
+
+    application = QgsApplication([], False)
+    application.initQgis()
+
+    try:
+        points = filter_points(read_points(arguments.point_cloud), point_filter)
+
+        bathymetry_layer = None
+        if arguments.bathymetry:
+            bathymetry_layer = QgsRasterLayer(arguments.bathymetry, "", "gdal")
+
+        end_points = [arguments.end_points[:2], arguments.end_points[2:]]
+
+        if arguments.diff_dir:
+            os.makedirs(arguments.diff_dir, exist_ok=True)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = compare_variants(points, end_points, arguments.variants, output_dir, bathymetry_layer=bathymetry_layer,
+                repeat=arguments.repeat, tolerance=arguments.tolerance, position_tolerance=arguments.position_tolerance,
+                depth_tolerance=arguments.depth_tolerance, diff_dir=arguments.diff_dir, processes=arguments.processes,
+                widths=arguments.widths, **settings)
+    finally:
+        application.exitQgis()
+
+    print_results(results)
+
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    sys.exit(0 if all(result["match"] for result in results.values()) else 1)
+
+if __name__ == "__main__":
+    main()
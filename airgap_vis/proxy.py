@@ -0,0 +1,291 @@
+from email.utils import formatdate
+from urllib.parse import urlencode, urlsplit
+from urllib.request import urlopen
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import xml.etree.ElementTree as ElementTree
+
+#A caching proxy for the tide and gage feeds used by airgap.js. Each station or gage is fetched
+#from upstream at most once per TTL no matter how many browsers ask for it, concurrent requests
+#for the same feed share one upstream fetch and responses carry an ETag so browsers can revalidate.
+#
+#Run with python -m airgap_vis.proxy --config proxy.json
+
+TIDES_URL = "https://api.tidesandcurrents.noaa.gov/api/prod/datagetter"
+GAGES_URL = "https://water.weather.gov/ahps2/hydrograph_to_xml.php"
+
+FEET_TO_METERS = 0.3048
+
+log = logging.getLogger("airgap_vis.proxy")
+
+class UpstreamError(Exception):
+    pass
+
+class CacheEntry():
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.fetched = time.monotonic()
+        self.last_modified = formatdate(usegmt=True)
+
+class FeedProxy():
+    def __init__(self, tides_url=TIDES_URL, gages_url=GAGES_URL, station_ttl=360, gage_ttl=900, bridges=None, timeout=30, retry_interval=30):
+        self.tides_url = tides_url
+        self.gages_url = gages_url
+        self.station_ttl = station_ttl
+        self.gage_ttl = gage_ttl
+        self.bridges = bridges or {}
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+
+        self.cache = {}
+        self.pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_requests = 0
+
+    def station_url(self, station):
+        return self.tides_url + "?" + urlencode({
+            "date": "latest",
+            "station": station,
+            "product": "air_gap",
+            "time_zone": "gmt",
+            "units": "metric",
+            "format": "json"
+        })
+
+    def gage_url(self, gage):
+        return self.gages_url + "?" + urlencode({"gage": gage, "output": "xml"})
+
+    def download(self, url):
+        self.upstream_requests += 1
+
+        with urlopen(url, timeout=self.timeout) as response:
+            return response.read()
+
+    async def fetch(self, key, url, ttl, content_type):
+        entry = self.cache.get(key)
+
+        if entry and time.monotonic() - entry.fetched < ttl:
+            self.hits += 1
+            return entry
+
+        #the first request for an expired feed starts the download and every request that arrives
+        #while it is running waits on the same task
+        if key in self.pending:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            self.pending[key] = asyncio.ensure_future(self.refresh(key, url, ttl, content_type))
+
+        return await asyncio.shield(self.pending[key])
+
+    async def refresh(self, key, url, ttl, content_type):
+        try:
+            body = await asyncio.get_running_loop().run_in_executor(None, self.download, url)
+            self.cache[key] = CacheEntry(body, content_type)
+        except Exception as e:
+            if key not in self.cache:
+                raise UpstreamError(f"Unable to load {url}: {e}")
+
+            #a stale value is more useful to the viewer than an error. It is served as if fresh until
+            #the retry interval passes, so requests do not each wait on a failing upstream.
+            log.warning("Unable to refresh %s, serving cached data: %s", url, e)
+            self.cache[key].fetched = time.monotonic() - ttl + min(self.retry_interval, ttl)
+        finally:
+            del self.pending[key]
+
+        return self.cache[key]
+
+    async def station(self, station):
+        return await self.fetch(("station", station), self.station_url(station), self.station_ttl, "application/json")
+
+    async def gage(self, gage):
+        return await self.fetch(("gage", gage), self.gage_url(gage), self.gage_ttl, "text/xml")
+
+    async def gage_level(self, gage):
+        entry = await self.gage(gage)
+
+        try:
+            root = ElementTree.fromstring(entry.body)
+        except ElementTree.ParseError as e:
+            raise UpstreamError(f"Unable to read gage {gage}: {e}")
+
+        #same as the querySelector calls in airgap.js, the first primary and valid elements are the
+        #most recent observation
+        primary = next(root.iter("primary"), None)
+        valid = next(root.iter("valid"), None)
+
+        if primary is None or valid is None:
+            raise UpstreamError(f"Unable to load gage {gage}")
+
+        try:
+            level = float(primary.text)
+        except (TypeError, ValueError):
+            raise UpstreamError(f"Unable to read gage {gage}: {primary.text!r} is not a water level")
+
+        return level * FEET_TO_METERS, valid.text
+
+    async def bridge(self, name):
+        bridge = self.bridges[name]
+        gage_ids = bridge.get("gageIDs", [])
+        distances = bridge.get("gageDistances", [])
+        base_height = bridge.get("baseHeight", 0)
+        adjustment = bridge.get("waterLevelAdjustment", 0)
+
+        readings = await asyncio.gather(*[self.gage_level(gage) for gage in gage_ids])
+        levels = [reading[0] for reading in readings]
+
+        #matches WaterGageVisualization.loadAirGap
+        if len(levels) == 0:
+            water_level = 0
+            valid = None
+        elif len(levels) == 1:
+            water_level = levels[0]
+            valid = readings[0][1]
+        else:
+            change_per_meter = (levels[1] - levels[0]) / sum(distances)
+            water_level = levels[0] - change_per_meter * distances[0]
+            valid = readings[0][1]
+
+        body = json.dumps({
+            "bridge": name,
+            "gages": dict(zip(gage_ids, levels)),
+            "water_level": water_level,
+            "air_gap": base_height - adjustment - water_level,
+            "valid": valid
+        }).encode()
+
+        return CacheEntry(body, "application/json")
+
+    def statistics(self):
+        body = json.dumps({
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "upstream_requests": self.upstream_requests,
+            "cached": len(self.cache)
+        }).encode()
+
+        return CacheEntry(body, "application/json")
+
+    async def route(self, path):
+        parts = [part for part in path.split("/") if part]
+
+        if len(parts) == 2 and parts[0] == "station":
+            return await self.station(parts[1])
+        elif len(parts) == 2 and parts[0] == "gage":
+            return await self.gage(parts[1])
+        elif len(parts) == 2 and parts[0] == "bridge" and parts[1] in self.bridges:
+            return await self.bridge(parts[1])
+        elif parts == ["statistics"]:
+            return self.statistics()
+
+        return None
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            headers = {}
+
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                method, target, _ = request_line.decode("latin-1").split()
+            except ValueError:
+                return
+
+            if method not in ("GET", "HEAD"):
+                self.respond(writer, 405, "Method Not Allowed", method)
+                return
+
+            try:
+                entry = await self.route(urlsplit(target).path)
+            except UpstreamError as e:
+                log.warning("%s", e)
+                self.respond(writer, 502, "Bad Gateway", method, body=str(e).encode())
+                return
+
+            if entry is None:
+                self.respond(writer, 404, "Not Found", method)
+            elif headers.get("if-none-match") == entry.etag:
+                self.respond(writer, 304, "Not Modified", method, entry=entry)
+            else:
+                self.respond(writer, 200, "OK", method, entry=entry, body=entry.body)
+
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def respond(self, writer, status, reason, method, entry=None, body=b""):
+        headers = [
+            f"HTTP/1.1 {status} {reason}",
+            "Access-Control-Allow-Origin: *",
+            "Connection: close",
+            f"Content-Length: {len(body)}"
+        ]
+
+        if entry:
+            headers += [
+                f"Content-Type: {entry.content_type}",
+                f"ETag: {entry.etag}",
+                f"Last-Modified: {entry.last_modified}",
+                "Cache-Control: no-cache"
+            ]
+
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1"))
+
+        if method != "HEAD":
+            writer.write(body)
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+
+        log.info("Serving on %s", ", ".join(str(socket.getsockname()) for socket in server.sockets))
+
+        async with server:
+            await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Caching proxy for the air gap and water gage feeds")
+    parser.add_argument("--config", help="JSON file with ttl, upstream URL and bridge settings")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    arguments = parser.parse_args()
+
+    config = {}
+    if arguments.config:
+        with open(arguments.config) as f:
+            config = json.load(f)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    proxy = FeedProxy(
+        tides_url=config.get("tidesURL", TIDES_URL),
+        gages_url=config.get("gagesURL", GAGES_URL),
+        station_ttl=config.get("stationTTL", 360),
+        gage_ttl=config.get("gageTTL", 900),
+        bridges=config.get("bridges", {}),
+        retry_interval=config.get("retryInterval", 30)
+    )
+
+    try:
+        asyncio.run(proxy.serve(arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+#Runs the generation stages as a dependency graph on a thread pool. numpy, PIL and GDAL release
+#the GIL for most of their work, so stages that do not depend on each other overlap.
+
+class Stage():
+    def __init__(self, name, function, dependencies, weight, main_thread):
+        self.name = name
+        self.function = function
+        self.dependencies = set(dependencies)
+        self.weight = weight
+        self.main_thread = main_thread
+
+class StageScheduler():
+    def __init__(self, threads=4):
+        self.threads = threads
+        self.stages = {}
+
+    def add(self, name, function, dependencies=(), weight=1, main_thread=False):
+        #stages that use objects owned by the calling thread, such as QGIS layers or Qt widgets,
+        #can be kept on the thread that calls run
+        for dependency in dependencies:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+
+        self.stages[name] = Stage(name, function, dependencies, weight, main_thread)
+
+    def run(self, progress=None, poll=None, poll_interval=0.1):
+        #progress is called with the completed fraction of the total weight and poll is called
+        #while waiting, both from the thread that calls run
+        total_weight = sum(stage.weight for stage in self.stages.values()) or 1
+        completed_weight = 0
+
+        results = {}
+        waiting = dict(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            while waiting or running:
+                ready = [stage for stage in waiting.values() if stage.dependencies.issubset(results)]
+
+                for stage in ready:
+                    del waiting[stage.name]
+
+                    if not stage.main_thread:
+                        running[pool.submit(stage.function)] = stage
+
+                for stage in ready:
+                    if stage.main_thread:
+                        results[stage.name] = stage.function()
+                        completed_weight += stage.weight
+
+                        if progress:
+                            progress(completed_weight / total_weight)
+
+                if not running:
+                    if waiting and not ready:
+                        raise ValueError("Stage dependencies contain a cycle")
+                    continue
+
+                done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage = running.pop(future)
+                    results[stage.name] = future.result()
+                    completed_weight += stage.weight
+
+                    if progress:
+                        progress(completed_weight / total_weight)
+
+                if poll:
+                    poll()
+
+        return results
@@ -0,0 +1,324 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from qgis.core import QgsApplication, QgsRasterLayer
+
+from .airgap import *
+from .cache import PointCloudCache
+
+#Regenerates the files for configured bridges when point clouds or bathymetry rasters are added
+#to or changed in a watched folder. Only the files whose inputs changed are regenerated, and new
+#files are written to a staging folder and moved into place so a viewer never reads a partial file.
+#
+#Run with python -m airgap_vis.watch --config watch.json
+
+POINT_CLOUD_EXTENSIONS = (".las", ".laz")
+RASTER_EXTENSIONS = (".tif", ".tiff", ".img", ".vrt")
+
+POINT_CLOUD_CACHE_BYTES = 4 * 1024**3
+
+log = logging.getLogger("airgap_vis.watch")
+
+class SourceFile():
+    def __init__(self, path, mtime, size, bounds):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.bounds = bounds
+
+    @property
+    def fingerprint(self):
+        return [self.path, self.mtime, self.size]
+
+    def covers(self, end_points):
+        x_minimum, y_minimum, x_maximum, y_maximum = self.bounds
+
+        return all(x_minimum <= x <= x_maximum and y_minimum <= y <= y_maximum for x, y in end_points)
+
+def point_cloud_bounds(path):
+    import laspy
+
+    #only the header is read, which also covers COPC files since they are LAZ files
+    with laspy.open(path) as f:
+        return f.header.mins[0], f.header.mins[1], f.header.maxs[0], f.header.maxs[1]
+
+def raster_bounds(path):
+    layer = QgsRasterLayer(path, "", "gdal")
+
+    if not layer.isValid():
+        return None
+
+    extent = layer.extent()
+
+    return extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()
+
+def generation_settings(config):
+    #same keys as the plugin's generation settings, with the enums given by value. The point filter
+    #is applied when the point cloud is read rather than per bridge.
+    settings = dict(config)
+
+    settings.pop("threads", None)
+    settings.pop("point_filter", None)
+
+    if "direction" in settings:
+        settings["direction"] = Direction(settings["direction"])
+    if "statistic" in settings:
+        settings["statistic"] = ContourStatistic(settings["statistic"])
+    if "engine" in settings:
+        settings["engine"] = Engine(settings["engine"])
+
+    return settings
+
+class Watcher():
+    def __init__(self, input_dir, output_dir, bridges, settings=None, workers=2, interval=10, corridor_width=100, cell_size=50):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.bridges = bridges
+        self.settings = settings or {}
+        self.point_filter = self.settings.get("point_filter", DEFAULT_POINT_FILTER)
+        self.workers = workers
+        self.interval = interval
+        self.corridor_width = corridor_width
+        self.cell_size = cell_size
+
+        self.point_clouds = {}
+        self.rasters = {}
+        self.changing = {}
+
+        self.point_cache = PointCloudCache(POINT_CLOUD_CACHE_BYTES)
+        self.manifest_path = os.path.join(output_dir, "manifest.json")
+        self.manifest = {}
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+        self.stopped = threading.Event()
+
+    def artifact_paths(self, bridge):
+        return {
+            "contour": os.path.join(self.output_dir, f"contour_{bridge}.json"),
+            "depth": os.path.join(self.output_dir, f"depth_{bridge}.json"),
+            Direction.EAST_TO_WEST.value: os.path.join(self.output_dir, f"east_west_{bridge}.png"),
+            Direction.WEST_TO_EAST.value: os.path.join(self.output_dir, f"west_east_{bridge}.png")
+        }
+
+    def scan(self):
+        #a file is only used once its size and modification time are the same on two scans in a
+        #row, so files that are still being copied in are left alone. Returns whether anything changed.
+        seen = {}
+
+        for entry in os.scandir(self.input_dir):
+            name = entry.name.lower()
+
+            if entry.is_file() and name.endswith(POINT_CLOUD_EXTENSIONS + RASTER_EXTENSIONS):
+                status = entry.stat()
+                seen[entry.path] = (status.st_mtime, status.st_size)
+
+        changed = False
+
+        for sources in [self.point_clouds, self.rasters]:
+            for path in [path for path in sources if path not in seen]:
+                log.info("Removed %s", path)
+                del sources[path]
+                changed = True
+
+        for path, (mtime, size) in seen.items():
+            is_point_cloud = path.lower().endswith(POINT_CLOUD_EXTENSIONS)
+            sources = self.point_clouds if is_point_cloud else self.rasters
+            known = sources.get(path)
+
+            if known and (known.mtime, known.size) == (mtime, size):
+                continue
+
+            if self.changing.get(path) != (mtime, size):
+                self.changing[path] = (mtime, size)
+                continue
+
+            del self.changing[path]
+
+            try:
+                bounds = point_cloud_bounds(path) if is_point_cloud else raster_bounds(path)
+            except Exception as e:
+                log.warning("Unable to read %s: %s", path, e)
+                continue
+
+            if bounds == None:
+                log.warning("Unable to read %s", path)
+                continue
+
+            log.info("%s %s", "Changed" if known else "Found", path)
+            sources[path] = SourceFile(path, mtime, size, bounds)
+            changed = True
+
+        return changed
+
+    def newest_covering(self, sources, end_points):
+        covering = [source for source in sources.values() if source.covers(end_points)]
+
+        return max(covering, key=lambda source: source.mtime, default=None)
+
+    def plan(self, bridge):
+        #each file records the inputs it was made from, so a file is stale when those inputs change
+        #or the file is missing. Returns the point cloud, bathymetry and stale files for the bridge.
+        end_points = self.bridges[bridge]["end_points"]
+
+        point_cloud = self.newest_covering(self.point_clouds, end_points)
+
+        if point_cloud == None:
+            return None, None, {}
+
+        bathymetry = self.newest_covering(self.rasters, end_points)
+
+        settings_hash = hashlib.sha1(json.dumps([end_points, self.settings, self.point_filter], sort_keys=True).encode()).hexdigest()
+
+        inputs = {
+            "contour": [point_cloud.fingerprint, settings_hash],
+            "depth": [point_cloud.fingerprint, bathymetry and bathymetry.fingerprint, settings_hash]
+        }
+
+        #the images are padded by the maximum depth, so they depend on the bathymetry as well
+        for direction in Direction:
+            inputs[direction.value] = inputs["depth"]
+
+        if bathymetry == None:
+            del inputs["depth"]
+
+        recorded = self.manifest.get(bridge, {})
+        paths = self.artifact_paths(bridge)
+
+        stale = {artifact: artifact_inputs for artifact, artifact_inputs in inputs.items()
+            if recorded.get(artifact) != artifact_inputs or not os.path.exists(paths[artifact])}
+
+        #the maximum depth is only known after sampling, so the images bring the depth with them
+        if bathymetry and any(direction.value in stale for direction in Direction):
+            stale["depth"] = inputs["depth"]
+
+        return point_cloud, bathymetry, stale
+
+    def generate(self, points, grid, bridge, bathymetry, stale):
+        #runs on a worker thread, so the raster layer is created here rather than shared
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.output_dir)
+
+        try:
+            paths = {artifact: os.path.join(staging, os.path.basename(path)) for artifact, path in self.artifact_paths(bridge).items()}
+
+            bathymetry_layer = None
+            if bathymetry:
+                bathymetry_layer = QgsRasterLayer(bathymetry.path, "", "gdal")
+
+            job = bridge_job(points, grid, self.bridges[bridge]["end_points"], paths["contour"], depth_path=paths["depth"],
+                bathymetry_layer=bathymetry_layer, corridor_width=self.corridor_width, **generation_settings(self.settings))
+            job.run(stages=stale)
+
+            job.save_images(paths, directions=[direction for direction in job.directions if direction.value in stale])
+
+            #os.replace is atomic within a file system and the staging folder is inside the output
+            #folder, so each file is either the old one or the complete new one
+            for name in os.listdir(staging):
+                os.replace(os.path.join(staging, name), os.path.join(self.output_dir, name))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def regenerate(self):
+        plans = {}
+
+        for bridge in self.bridges:
+            point_cloud, bathymetry, stale = self.plan(bridge)
+
+            if stale:
+                plans.setdefault(point_cloud.path, []).append((bridge, bathymetry, stale))
+
+        if not plans:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            #one point cloud is read and indexed at a time and shared by all the bridges it covers
+            for point_cloud_path, bridges in plans.items():
+                try:
+                    points = filter_points(cached_read_points(point_cloud_path, self.point_cache), self.point_filter)
+                except Exception as e:
+                    log.warning("Unable to read %s: %s", point_cloud_path, e)
+                    continue
+
+                grid = PointGrid(points.xyz, cell_size=self.cell_size)
+
+                futures = {bridge: (pool.submit(self.generate, points, grid, bridge, bathymetry, stale), stale)
+                    for bridge, bathymetry, stale in bridges}
+
+                for bridge, (future, stale) in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        log.warning("Unable to generate bridge %s: %s", bridge, e)
+                        continue
+
+                    log.info("Generated %s for bridge %s from %s", ", ".join(sorted(stale)), bridge, point_cloud_path)
+                    self.manifest.setdefault(bridge, {}).update(stale)
+
+                self.save_manifest()
+
+    def save_manifest(self):
+        temporary_path = self.manifest_path + ".tmp"
+
+        with open(temporary_path, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+
+        os.replace(temporary_path, self.manifest_path)
+
+    def run(self):
+        log.info("Watching %s for %d bridges", self.input_dir, len(self.bridges))
+
+        while not self.stopped.is_set():
+            self.scan()
+
+            #planning only compares the manifest, so it runs on every scan. A bridge that failed
+            #stays stale and is tried again, and a deleted output is made again.
+            self.regenerate()
+
+            self.stopped.wait(self.interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate air gap visualization files when point clouds or bathymetry change")
+    parser.add_argument("--config", required=True, help="JSON file with the folders, bridges and generation settings")
+    arguments = parser.parse_args()
+
+    with open(arguments.config) as f:
+        config = json.load(f)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    application = QgsApplication([], False)
+    application.initQgis()
+
+    watcher = Watcher(
+        config["input"],
+        config["output"],
+        config["bridges"],
+        settings=config.get("settings", {}),
+        workers=config.get("workers", 2),
+        interval=config.get("interval", 10),
+        corridor_width=config.get("corridorWidth", 100),
+        cell_size=config.get("cellSize", 50)
+    )
+
+    signal.signal(signal.SIGINT, lambda *_: watcher.stopped.set())
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stopped.set())
+
+    try:
+        watcher.run()
+    finally:
+        application.exitQgis()
+
+if __name__ == "__main__":
+    main()
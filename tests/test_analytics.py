@@ -0,0 +1,22 @@
+import numpy
+
+from airgap_vis.analytics import clearance_windows
+
+def test_blocked_columns_stay_blocked_at_low_water():
+    heights = [0, 0, 30, 30, 30, 0, 0]
+    times = numpy.arange(3).astype("datetime64[h]").astype("datetime64[s]")
+
+    windows, series = clearance_windows(heights, 1, times, numpy.full(3, -15.0), [10])
+
+    assert (series["widest_widths"] == 3).all()
+    assert (series["passable_widths"] == 3).all()
+    assert windows[0]["span_start"] == 2 and windows[0]["width"] == 3
+
+def test_window_closes_when_water_rises():
+    heights = [0, 20, 25, 20, 0]
+    times = numpy.arange(4).astype("datetime64[h]").astype("datetime64[s]")
+
+    windows, series = clearance_windows(heights, 1, times, numpy.array([0, 0, 18, 0]), [10])
+
+    assert series["passable"][:,0].tolist() == [True, True, False, True]
+    assert len(windows) == 2
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+import numpy
+import pytest
+
+pytest.importorskip("qgis")
+pytest.importorskip("scipy")
+
+from airgap_vis import kernels
+from airgap_vis.airgap import AirGapPoints, Direction, Engine, decimate_points, find_color
+
+#each kernel is checked against the loop it replaces in AirGapPoints on the same inputs, with the
+#engine setting being the only difference
+
+def air_gap_points(xyz, engine, ends=([0, 0], [1, 0])):
+    points = SimpleNamespace(xyz=xyz.copy(), header=SimpleNamespace(mins=xyz.min(axis=0)))
+    return AirGapPoints(points, *ends, engine=engine)
+
+def image_points(count=20000, seed=0):
+    #pixel coordinates with depths at UTM northings, where many depths round to the same float32
+    rng = numpy.random.default_rng(seed)
+    xyz = numpy.column_stack([rng.uniform(0, 40, count), 3300000 + numpy.round(rng.uniform(0, 2, count), 2), rng.uniform(0, 30, count)])
+    colors = [rng.integers(0, 256, count).astype(numpy.uint8) for _ in range(3)]
+
+    return xyz, colors
+
+def draw(xyz, colors, direction, engine=Engine.REFERENCE):
+    color_grid = numpy.zeros([30, 40, 4], dtype=numpy.uint8)
+
+    if direction == Direction.WEST_TO_EAST:
+        closest_y = numpy.full([30, 40], numpy.max(xyz[:,1])+1, dtype=numpy.float32)
+    else:
+        closest_y = numpy.full([30, 40], numpy.min(xyz[:,1])-1, dtype=numpy.float32)
+
+    if engine == Engine.NUMPY:
+        return kernels.find_color(color_grid, closest_y, xyz, *colors, nearest_maximum=direction == Direction.EAST_TO_WEST)
+
+    return find_color(color_grid, closest_y, xyz, *colors, direction=direction)
+
+def image_colors(seed=0):
+    rng = numpy.random.default_rng(seed)
+    colors = rng.integers(1, 256, [40, 60, 4]).astype(numpy.uint8)
+
+    colors[...,3] = numpy.where(rng.random([40, 60]) < 0.5, 255, 0)
+    colors[:,rng.random(60) < 0.3] = 0
+
+    return colors
+
+@pytest.mark.parametrize("direction", list(Direction))
+def test_find_color(direction):
+    xyz, colors = image_points()
+
+    assert numpy.array_equal(draw(xyz, colors, direction), draw(xyz, colors, direction, Engine.NUMPY))
+
+@pytest.mark.parametrize("direction", list(Direction))
+def test_decimated_points_draw_the_same_image(direction):
+    xyz, colors = image_points()
+    kept = decimate_points(xyz, 40, direction)
+
+    assert len(kept) < len(xyz)
+    assert numpy.array_equal(draw(xyz, colors, direction), draw(xyz[kept], [color[kept] for color in colors], direction))
+
+@pytest.mark.parametrize("draw_lower", [True, False])
+def test_average_and_color(draw_lower):
+    colors = {engine: image_colors() for engine in Engine}
+
+    for engine in Engine:
+        air_gap_points(numpy.zeros([1, 3]), engine).average_and_color([[10, 30], [5, 50]], colors[engine], draw_lower, alpha=128)
+
+    assert numpy.array_equal(colors[Engine.REFERENCE], colors[Engine.NUMPY])
+
+@pytest.mark.parametrize("paddings", [(0, 10, 0), (5, 10, 3)])
+def test_color_obstructions(paddings):
+    padding_left, padding_bottom, padding_right = paddings
+    colors = {engine: image_colors(1) for engine in Engine}
+
+    for engine in Engine:
+        air_gap_points(numpy.zeros([1, 3]), engine).color_obstructions(colors[engine], padding_left, padding_bottom, padding_right, 20)
+
+    assert numpy.array_equal(colors[Engine.REFERENCE], colors[Engine.NUMPY])
+
+def test_refine_ends():
+    rng = numpy.random.default_rng(2)
+    x = rng.uniform(-20, 120, 20000)
+    z = numpy.where((x > 3.3) & (x < 96.1), rng.uniform(20, 30, len(x)), rng.uniform(0, 5, len(x)))
+    xyz = numpy.column_stack([500000 + x, numpy.full(len(x), 3300000.0), z])
+
+    r_ends = [[500000.0, 3300000.0], [500100.0, 3300000.0]]
+    refined = {engine: air_gap_points(xyz, engine, r_ends).refine_ends(r_ends, 0, lambda height: height > 10) for engine in Engine}
+
+    assert refined[Engine.REFERENCE] == refined[Engine.NUMPY]
+
+def test_contour_heights(tmp_path):
+    pytest.importorskip("pyproj")
+
+    rng = numpy.random.default_rng(3)
+    t = rng.uniform(0, 300, 20000)
+    z = numpy.where(rng.random(len(t)) < 0.2, rng.uniform(0, 40, len(t)), 30 + 5 * numpy.sin(t / 60))
+    xyz = numpy.column_stack([500000 + t, 3300000 + rng.uniform(-5, 5, len(t)), z])
+
+    #a gap in the points leaves empty bins, which carry the height before them
+    xyz = xyz[(t < 100) | (t > 110)]
+
+    contours = {}
+    for engine in Engine:
+        point_cloud = air_gap_points(xyz, engine, ([500000.0, 3300000.0], [500300.0, 3300000.0]))
+        point_cloud.create_contour(str(tmp_path / f"{engine.value}.json"), minimum_height=25, steps=200, refine_ends=False)
+        contours[engine] = point_cloud.contour
+
+    assert numpy.array_equal(contours[Engine.REFERENCE], contours[Engine.NUMPY])
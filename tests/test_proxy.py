@@ -0,0 +1,119 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import asyncio
+import threading
+import time
+
+from airgap_vis.proxy import FeedProxy
+
+class StandIn():
+    #a local stand-in for the upstream feeds that counts its requests and can be made to fail
+    def __init__(self, body=b'{"data": []}', delay=0):
+        self.body = body
+        self.delay = delay
+        self.status = 200
+        self.requests = 0
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests += 1
+                time.sleep(stand_in.delay)
+
+                self.send_response(stand_in.status)
+                self.send_header("Content-Length", str(len(stand_in.body)))
+                self.end_headers()
+                self.wfile.write(stand_in.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+async def get(port, path, headers=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    lines = [f"GET {path} HTTP/1.1", "Host: localhost"] + [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    head = head.decode("latin-1").split("\r\n")
+    response_headers = dict(line.split(": ", 1) for line in head[1:])
+
+    return int(head[0].split()[1]), response_headers, body
+
+def serve(proxy, requests):
+    #runs the proxy on a free port for as long as requests, a coroutine taking the port, takes
+    async def main():
+        server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+
+        async with server:
+            return await requests(server.sockets[0].getsockname()[1])
+
+    return asyncio.run(main())
+
+def test_concurrent_requests_share_one_upstream_fetch():
+    with StandIn(delay=0.2) as stand_in:
+        proxy = FeedProxy(tides_url=stand_in.url)
+
+        responses = serve(proxy, lambda port: asyncio.gather(*[get(port, "/station/8454000") for _ in range(10)]))
+
+    assert [status for status, _, _ in responses] == [200] * 10
+    assert stand_in.requests == 1
+    assert proxy.misses == 1 and proxy.coalesced == 9
+
+def test_matching_etag_is_not_modified():
+    with StandIn() as stand_in:
+        proxy = FeedProxy(tides_url=stand_in.url)
+
+        async def requests(port):
+            _, headers, _ = await get(port, "/station/8454000")
+            return await get(port, "/station/8454000", {"If-None-Match": headers["ETag"]})
+
+        status, _, body = serve(proxy, requests)
+
+    assert status == 304 and body == b""
+
+def test_stale_data_is_served_while_upstream_fails():
+    with StandIn() as stand_in:
+        proxy = FeedProxy(tides_url=stand_in.url)
+
+        async def requests(port):
+            first = await get(port, "/station/8454000")
+
+            #expires the cached response rather than waiting out the TTL
+            for entry in proxy.cache.values():
+                entry.fetched -= proxy.station_ttl
+
+            stand_in.status = 500
+            return first, await get(port, "/station/8454000"), await get(port, "/station/8454000")
+
+        first, stale, backed_off = serve(proxy, requests)
+
+    assert first[0] == stale[0] == backed_off[0] == 200
+    assert stale[2] == backed_off[2] == first[2]
+
+    #the failed refresh holds off upstream until the retry interval passes
+    assert stand_in.requests == 2
+
+def test_malformed_gage_is_a_bad_gateway():
+    with StandIn(body=b"<html><body>Service Unavailable") as stand_in:
+        proxy = FeedProxy(gages_url=stand_in.url, bridges={"bridge": {"gageIDs": ["gage"]}})
+
+        status, _, _ = serve(proxy, lambda port: get(port, "/bridge/bridge"))
+
+    assert status == 502
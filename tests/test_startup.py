@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#QGIS, PyQt and the heavy dependencies are stubbed, so an eager import of any of them shows up in
+#sys.modules rather than failing when it is not installed
+STARTUP = """
+import glob
+import importlib.abc
+import importlib.machinery
+import json
+import re
+import sys
+import time
+import types
+
+STUBBED = ("qgis", "PyQt5", "laspy", "PIL", "scipy", "pyproj")
+SUBMODULES = ("core", "PyQt", "QtCore", "QtGui", "QtWidgets", "uic")
+
+#star imports only take the names in __all__, so every Qt and QGIS name the plugin uses is listed
+NAMES = set()
+for path in glob.glob("airgap_vis/*.py"):
+    with open(path) as f:
+        NAMES.update(re.findall(r"\\bQ[a-zA-Z]*\\b|\\bNULL\\b", f.read()))
+
+class StubType(type):
+    def __getattr__(cls, name):
+        return cls
+
+class Stub(metaclass=StubType):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return Stub()
+
+    def __call__(self, *args, **kwargs):
+        return Stub()
+
+    def __getitem__(self, key):
+        return ""
+
+class StubModule(types.ModuleType):
+    def __getattr__(self, name):
+        #submodules are imported through the finder so that they appear in sys.modules
+        if name.startswith("__") or name in SUBMODULES:
+            raise AttributeError(name)
+        return Stub
+
+class StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def find_spec(self, name, path, target=None):
+        if name.split(".")[0] in STUBBED:
+            return importlib.machinery.ModuleSpec(name, self, is_package=True)
+
+    def create_module(self, spec):
+        return StubModule(spec.name)
+
+    def exec_module(self, module):
+        module.__path__ = []
+        module.__all__ = sorted(NAMES - set(SUBMODULES))
+        module.qVersion = lambda: "5.15.0"
+
+sys.meta_path.insert(0, StubFinder())
+
+start = time.perf_counter()
+
+import airgap_vis
+airgap_vis.classFactory(Stub())
+
+elapsed = time.perf_counter() - start
+
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+def startup():
+    result = subprocess.run([sys.executable, "-c", STARTUP], cwd=ROOT, capture_output=True, text=True, check=True)
+
+    return json.loads(result.stdout.splitlines()[-1])
+
+def test_class_factory_does_not_import_heavy_modules():
+    modules = startup()["modules"]
+
+    for module in ["laspy", "PIL", "scipy", "pyproj", "qgis.PyQt.uic", "numpy", "multiprocessing", "concurrent.futures"]:
+        assert module not in modules
+
+def test_class_factory_does_not_import_the_generation_code():
+    modules = startup()["modules"]
+
+    for module in ["airgap", "kernels", "parallel", "scheduler"]:
+        assert f"airgap_vis.{module}" not in modules
+
+def test_class_factory_is_quick():
+    #with the stubs, loading the plugin takes a few milliseconds, importing numpy alone takes longer
+    #than this
+    assert startup()["elapsed"] < 0.02